@@ -1,32 +1,168 @@
 import os
 import json
-import cv2
-import torch
+import hashlib
 import warnings
 import numpy as np
-import pandas as pd
-import pytesseract
 from PIL import Image
 from pathlib import Path
-from transformers import AutoProcessor, AutoModelForTokenClassification
-from torch.nn import functional as nnf
+from cache import DiskCache, MemoryCache, TieredCache, file_digest
+from ocr import OCR_CACHE_DIR, extract_words
+from ocr_backends import get_backend, image_digest
+from model_backends import OnnxModel, TorchModel, load_quantized_model, require
+
+# torch, transformers and cv2 are imported when first needed so that importing this module stays fast
 
 os.environ["TOKENIZERS_PARALLELISM"] = "false"
 warnings.filterwarnings("ignore")
 
+RESULT_CACHE_DIR = ".result_cache"
+
+
+def token_confidence(logits):
+    """Probability of the predicted label of every token, softmax over the label axis."""
+    logits = np.asarray(logits, dtype=np.float32)
+    exp = np.exp(logits - logits.max(axis=-1, keepdims=True))
+    return (exp / exp.sum(axis=-1, keepdims=True)).max(axis=-1)
+
+
+def load_image(image):
+    """Decode an image path or PIL image into an RGB array, arrays are passed through untouched."""
+    if isinstance(image, np.ndarray):
+        return image
+    if not isinstance(image, Image.Image):
+        image = Image.open(image)
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    return np.asarray(image)
+
+
+class Spans:
+    """Entity spans stored as arrays: start (n, 2), end (n, 2) and label (n,)."""
+
+    def __init__(self, start, end, label):
+        self.start = start
+        self.end = end
+        self.label = label
+
+    def __len__(self):
+        return len(self.label)
+
+    def __iter__(self):
+        """Yield (x1, y1, x2, y2, label) for every span."""
+        for (x1, y1), (x2, y2), label in zip(self.start.tolist(), self.end.tolist(), self.label.tolist()):
+            yield x1, y1, x2, y2, label
+
 
 class ImageAnnotator:
-    def __init__(self, model_path="model", labels_path="labels.json", margin=5):
-        self.model, self.label2id = self.load_model_and_labels(
-            model_path, labels_path)
-        self.processor = AutoProcessor.from_pretrained(
-            "microsoft/layoutlmv3-base", apply_ocr=True)
+    def __init__(self, model_path="model", labels_path="labels.json", margin=5, single_ocr_pass=False,
+                 ocr_backend="pytesseract", ocr_cache_dir=OCR_CACHE_DIR, model_backend="torch",
+                 onnx_path="model.onnx", quantized_path="model_quantized", num_threads=None,
+                 max_length=256, windowed=False, window_stride=128, result_cache=True,
+                 result_cache_dir=RESULT_CACHE_DIR, result_cache_max_bytes=1 << 30,
+                 result_cache_memory_bytes=64 << 20):
+        if model_backend not in ("torch", "onnx", "quantized"):
+            raise ValueError(f"Unknown model backend {model_backend}")
+        if model_backend == "onnx":
+            # the model is only loaded on the first prediction, a missing runtime is reported now
+            require("onnxruntime", "The onnx model backend")
+        self.label2id = self.load_labels(labels_path)
+        # The model and the processor are loaded on the first prediction
+        self.model_path = model_path
+        self.labels_path = labels_path
+        self.model_backend = model_backend
+        self.onnx_path = onnx_path
+        self.quantized_path = quantized_path
+        self.num_threads = num_threads
+        self._model = None
+        self._processor = None
+        self._fingerprint = None
+        # In windowed mode the page is split into overlapping windows of max_length tokens instead of
+        # being truncated, the windows are built from our own OCR words so it implies single_ocr_pass
+        self.max_length = max_length
+        self.windowed = windowed
+        self.window_stride = window_stride
+        single_ocr_pass = single_ocr_pass or windowed
+        # In single OCR pass mode the page is OCR'd once by us and the words are fed to the processor
+        self.single_ocr_pass = single_ocr_pass
+        # Only the OCR done by us goes through the cache, use single_ocr_pass to also cover the processor's
+        self.ocr_backend = get_backend(
+            ocr_backend, lang='fra', cache_dir=ocr_cache_dir)
         self.id2label = {v: k for k, v in self.label2id.items()}
+        self.label_names = np.array([self.id2label.get(i, "O")
+                                    for i in range(max(self.id2label) + 1)])
         self.margin = margin
+        # Results are cached by image content and model fingerprint, result_cache_dir=None keeps them in memory only
+        self.result_cache = None
+        if result_cache:
+            self.result_cache = TieredCache(
+                MemoryCache(result_cache_memory_bytes),
+                DiskCache(result_cache_dir, result_cache_max_bytes) if result_cache_dir else None)
 
-    def load_model_and_labels(self, model_path, labels_path):
+    @property
+    def model(self):
+        """Callable returning the logits of an encoding as a NumPy array."""
+        if self._model is None:
+            self._model = self.load_model()
+        return self._model
+
+    @property
+    def processor(self):
+        if self._processor is None:
+            from transformers import AutoProcessor
+            self._processor = AutoProcessor.from_pretrained(
+                "microsoft/layoutlmv3-base", apply_ocr=not self.single_ocr_pass)
+        return self._processor
+
+    def load_model(self):
+        if self.model_backend == "onnx":
+            return OnnxModel(self.onnx_path, self.num_threads)
+        if self.model_backend == "quantized":
+            return TorchModel(load_quantized_model(self.quantized_path), self.num_threads)
+        model, _ = self.load_model_and_labels(
+            self.model_path, self.labels_path)
+        return TorchModel(model, self.num_threads)
+
+    def fingerprint(self):
+        """Hash of the model weights, the labels and the settings that change the predictions."""
+        if self._fingerprint is None:
+            artifact = Path({"torch": self.model_path, "onnx": self.onnx_path,
+                             "quantized": self.quantized_path}[self.model_backend])
+            if artifact.is_dir():
+                paths = sorted(path for path in artifact.rglob("*") if path.is_file())
+            else:
+                paths = [artifact] if artifact.exists() else []
+            # without a fine-tuned model the base model is used
+            parts = [f"{path.relative_to(artifact) if artifact.is_dir() else path.name}:{file_digest(path)}"
+                     for path in paths] or ["microsoft/layoutlmv3-base"]
+            parts.append(f"labels:{file_digest(self.labels_path)}")
+            parts.append(json.dumps({
+                "model_backend": self.model_backend, "max_length": self.max_length,
+                "windowed": self.windowed, "window_stride": self.window_stride,
+                "single_ocr_pass": self.single_ocr_pass, "margin": self.margin,
+            }, sort_keys=True))
+            self._fingerprint = hashlib.sha256(
+                "\n".join(parts).encode()).hexdigest()
+        return self._fingerprint
+
+    def cache_key(self, image, kind, page_words=None):
+        """Key of a cached value computed from the image, the model and the OCR settings."""
+        parts = [kind, image_digest(image), self.fingerprint(), self.ocr_backend.name,
+                 str(self.ocr_backend.lang), str(self.ocr_backend.config)]
+        if page_words is not None:
+            parts.append(json.dumps(page_words, default=int))
+        return hashlib.sha256("|".join(parts).encode()).hexdigest()
+
+    def cache_stats(self):
+        """Hits, misses, evictions and size of every tier of the result cache."""
+        return self.result_cache.stats() if self.result_cache is not None else {}
+
+    def load_labels(self, labels_path):
         with open(labels_path) as f:
-            label2id = json.load(f)
+            return json.load(f)
+
+    def load_model_and_labels(self, model_path, labels_path):
+        from transformers import AutoModelForTokenClassification
+        label2id = self.load_labels(labels_path)
         if Path(model_path).exists():
             model = AutoModelForTokenClassification.from_pretrained(
                 model_path, num_labels=len(label2id))
@@ -35,83 +171,149 @@ class ImageAnnotator:
                 "microsoft/layoutlmv3-base", num_labels=len(label2id))
         return model, label2id
 
-    def get_predictions(self, file_path):
-        image = Image.open(file_path).convert('RGB')
-        encoding = self.processor(image, max_length=256, padding="max_length",
-                                  truncation=True, return_tensors='pt', return_offsets_mapping=True)
+    def get_page_words(self, image):
+        """OCR the whole page once, returning the words and their pixel boxes."""
+        return extract_words(image, backend=self.ocr_backend)
 
-        with torch.no_grad():
-            op = self.model(
-                input_ids=encoding['input_ids'],
-                attention_mask=encoding['attention_mask'],
-                bbox=encoding['bbox'],
-                pixel_values=encoding['pixel_values']
-            )
-        return encoding, op.logits
+    def get_predictions(self, image, page_words=None):
+        image = load_image(image)
+        return self.get_batch_predictions([image], None if page_words is None else [page_words])
 
-    def process_logits(self, logits, encoding, width, height):
-        predictions = logits.argmax(-1).squeeze().tolist()
-        prob = nnf.softmax(logits, dim=1)
-        output_prob = np.max(prob.squeeze().numpy(), axis=1)
+    def encode(self, images, pages_words=None):
+        """Run the processor on a list of RGB image arrays, returning NumPy arrays.
+
+        When ``pages_words`` is given, the processor uses those OCR results instead of running its own OCR.
+        """
+        if pages_words is None:
+            return self.processor(images, max_length=self.max_length, padding="max_length",
+                                  truncation=True, return_tensors='np', return_offsets_mapping=True)
+        words = [page_words[0] for page_words in pages_words]
+        boxes = [self.normalize_boxes(page_words[1], image.shape[1], image.shape[0])
+                 for image, page_words in zip(images, pages_words)]
+        if not self.windowed:
+            return self.processor(images, words, boxes=boxes, max_length=self.max_length, padding="max_length",
+                                  truncation=True, return_tensors='np', return_offsets_mapping=True)
+        encoding = self.processor(images, words, boxes=boxes, max_length=self.max_length, padding="max_length",
+                                  truncation=True, stride=self.window_stride, return_overflowing_tokens=True,
+                                  return_tensors='np', return_offsets_mapping=True)
+        # the processor gives back one pixel_values array per window in a list
+        encoding['pixel_values'] = np.stack(encoding['pixel_values'])
+        return encoding
+
+    def get_batch_predictions(self, images, pages_words=None):
+        """Run the processor and the model on a list of RGB image arrays in a single forward pass."""
+        encoding = self.encode(images, pages_words)
+        return encoding, self.model(encoding)
+
+    @staticmethod
+    def normalize_boxes(boxes, width, height):
+        """Scale pixel boxes to the 0-1000 range expected by LayoutLMv3."""
+        return [[int(1000 * (box[0] / width)), int(1000 * (box[1] / height)),
+                 int(1000 * (box[2] / width)), int(1000 * (box[3] / height))] for box in boxes]
 
-        offset_mapping = encoding['offset_mapping'].squeeze().tolist()
-        is_subword = np.array([offset[0] != 0 for offset in offset_mapping])
+    def process_logits(self, logits, encoding, width, height):
+        logits = np.asarray(logits, dtype=np.float32).reshape(-1, logits.shape[-1])
+        predictions = logits.argmax(-1)
+        output_prob = token_confidence(logits)
 
-        true_predictions = [pred for idx, pred in enumerate(
-            predictions) if not is_subword[idx]]
-        true_boxes = [box for idx, box in enumerate(
-            encoding['bbox'].squeeze().tolist()) if not is_subword[idx]]
-        true_prob = [prob for idx, prob in enumerate(
-            output_prob) if not is_subword[idx]]
+        offset_mapping = np.asarray(encoding['offset_mapping']).reshape(-1, 2)
+        is_subword = offset_mapping[:, 0] != 0
 
-        true_boxes = np.array(true_boxes)
-        true_boxes[:, [0, 2]] = true_boxes[:, [0, 2]] * width / 1000
-        true_boxes[:, [1, 3]] = true_boxes[:, [1, 3]] * height / 1000
+        true_predictions = predictions[~is_subword]
+        true_prob = output_prob[~is_subword]
+        true_boxes = np.asarray(encoding['bbox']).reshape(-1, 4)[~is_subword]
+        # truncated to int like the original in-place assignment into the int array
+        true_boxes = (true_boxes * np.array([width, height, width, height]) / 1000).astype(int)
 
         return true_boxes, true_predictions, true_prob
 
-    def create_dataframe(self, true_boxes, true_predictions, true_prob):
-        data = []
-        for box, label_id, prob in zip(true_boxes, true_predictions, true_prob):
-            label = self.id2label[int(label_id)]
-            if label != "O" and box[0] != box[2]:
-                data.append({
-                    'start': (int(box[0]), int(box[1])),
-                    'end': (int(box[2]), int(box[3])),
-                    'label': label
-                })
-        if data == []:
+    def word_predictions(self, logits, encoding):
+        """For every OCR word, keep the prediction of the window where the model is the most confident.
+
+        Returns the page, word id, prediction, confidence and box of every word having a first sub-token
+        in some window, the words dropped by the tokenizer or truncated away are missing.
+        Without windows every row of the encoding is its own page.
+        """
+        offset_mapping = np.asarray(encoding['offset_mapping'])
+        sample_mapping = np.asarray(encoding.get('overflow_to_sample_mapping', np.arange(len(offset_mapping))))
+        word_ids = np.array([[-1 if word_id is None else word_id for word_id in encoding.word_ids(window)]
+                             for window in range(len(sample_mapping))])
+        window_idx, token_idx = np.nonzero(
+            (offset_mapping[..., 0] == 0) & (word_ids >= 0))
+
+        pages = sample_mapping[window_idx]
+        words = word_ids[window_idx, token_idx]
+        token_logits = np.asarray(logits)[window_idx, token_idx]
+        predictions = token_logits.argmax(-1)
+        confidence = token_confidence(token_logits)
+        boxes = np.asarray(encoding['bbox'])[window_idx, token_idx]
+
+        # sort by page, word and decreasing confidence, then keep the first token of every word
+        order = np.lexsort((-confidence, words, pages))
+        pages, words = pages[order], words[order]
+        keep = np.r_[True, (pages[1:] != pages[:-1]) | (words[1:] != words[:-1])]
+        return (pages[keep], words[keep], predictions[order][keep],
+                confidence[order][keep], boxes[order][keep])
+
+    def merge_windows(self, logits, encoding, images):
+        """Returns the true_boxes, true_predictions and true_prob of every image, one entry per word."""
+        pages, _, predictions, confidence, boxes = self.word_predictions(logits, encoding)
+        formatted = []
+        for page_idx, image in enumerate(images):
+            height, width = image.shape[:2]
+            in_page = pages == page_idx
+            true_boxes = (boxes[in_page] * np.array([width, height, width, height]) / 1000).astype(int)
+            formatted.append(
+                (true_boxes, predictions[in_page], confidence[in_page]))
+        return formatted
+
+    def get_spans(self, true_boxes, true_predictions, true_prob):
+        """Merge the B-/I- tokens into entity spans, dropping the "O" and empty boxes."""
+        labels = self.label_names[np.asarray(true_predictions, dtype=int)]
+        keep = (labels != "O") & (true_boxes[:, 0] != true_boxes[:, 2])
+        if not keep.any():
             raise ValueError("No labels detected in the image")
-        return pd.DataFrame(data)
-
-    def process_labels(self, df):
-        df['block'] = (df['label'].str.startswith('B')).cumsum()
-        result_df = df.groupby('block').agg({
-            'start': 'first',
-            'end': 'last',
-            'label': 'first'
-        }).reset_index(drop=True)
-        result_df['label'] = result_df['label'].str[2:]
-        return result_df
-
-    def annotate_image(self, image_path, result_df, save_path=None):
+        boxes, labels = true_boxes[keep], labels[keep]
+
+        # a new span starts at every B- token, tokens before the first one make their own span
+        block = np.cumsum(np.char.startswith(labels, 'B'))
+        first = np.flatnonzero(np.r_[True, block[1:] != block[:-1]])
+        last = np.r_[first[1:] - 1, len(block) - 1]
+        return Spans(boxes[first, :2], boxes[last, 2:],
+                     np.array([label[2:] for label in labels[first]]))
+
+    def get_region_text(self, page_words, x1, y1, x2, y2):
+        """Join the page words whose box centre falls inside the region, margin included."""
+        words, boxes = page_words
+        return ' '.join(word for word, box in zip(words, boxes)
+                        if x1 - self.margin <= (box[0] + box[2]) / 2 <= x2 + self.margin
+                        and y1 - self.margin <= (box[1] + box[3]) / 2 <= y2 + self.margin)
+
+    def annotate_image(self, image, spans, save_path=None, page_words=None):
         result_dict = {}
-        image = cv2.imread(image_path)
-        image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-        font = cv2.FONT_HERSHEY_SIMPLEX
-        font_scale = 0.5
-        font_color = (255, 0, 0)
-        font_thickness = 1
-
-        for _, row in result_df.iterrows():
-            x1, y1 = row['start']
-            x2, y2 = row['end']
-            label = row['label']
-            roi = image[max(0, y1-self.margin): min(image.shape[0], y2+self.margin),
-                        max(0, x1-self.margin): min(image.shape[1], x2+self.margin)]
-            ocr_text = pytesseract.image_to_string(
-                roi, lang='fra').replace('\n', ' ').strip()
+        image = load_image(image)
+
+        regions = list(spans)
+        if page_words is not None:
+            ocr_texts = [self.get_region_text(page_words, x1, y1, x2, y2)
+                         for x1, y1, x2, y2, _ in regions]
+        else:
+            # Crop every region first so the backend can OCR them all in one call
+            rois = [image[max(0, y1-self.margin): min(image.shape[0], y2+self.margin),
+                          max(0, x1-self.margin): min(image.shape[1], x2+self.margin)]
+                    for x1, y1, x2, y2, _ in regions]
+            ocr_texts = [text.replace('\n', ' ').strip()
+                         for text in self.ocr_backend.images_to_string(rois)]
 
+        if save_path:
+            import cv2
+            font = cv2.FONT_HERSHEY_SIMPLEX
+            font_scale = 0.5
+            font_color = (255, 0, 0)
+            font_thickness = 1
+            # draw on a copy, the decoded buffer is shared with the caller
+            image = image.copy()
+        for (x1, y1, x2, y2, label), ocr_text in zip(regions, ocr_texts):
             if label in result_dict:
                 result_dict[label].append(ocr_text)
             else:
@@ -126,34 +328,129 @@ class ImageAnnotator:
                             font, font_scale, font_color, font_thickness)
 
         if save_path:
-            cv2.imwrite(save_path, cv2.cvtColor(image, cv2.COLOR_RGB2BGR))
+            Image.fromarray(image).save(save_path)
 
         return result_dict
 
-    def get_formatted_predictions(self, file_path):
-        original_image = cv2.imread(file_path)
-        if original_image is None:
-            raise FileNotFoundError("Image not found")
-        height, width, _ = original_image.shape
-        encoding, logits = self.get_predictions(file_path)
-        true_boxes, true_predictions, true_prob = self.process_logits(
-            logits, encoding, width, height)
+    def get_formatted_predictions(self, image, page_words=None):
+        image = load_image(image)
+        if self.result_cache is None:
+            return self.get_batch_formatted_predictions([image], None if page_words is None else [page_words])[0]
+        key = self.cache_key(image, "formatted", page_words)
+        cached = self.result_cache.get(key)
+        if cached is not None:
+            return (np.array(cached["boxes"], dtype=int).reshape(-1, 4), np.array(cached["predictions"], dtype=int),
+                    np.array(cached["prob"], dtype=np.float32))
+        true_boxes, true_predictions, true_prob = self.get_batch_formatted_predictions(
+            [image], None if page_words is None else [page_words])[0]
+        self.result_cache.put(key, {"boxes": true_boxes.tolist(), "predictions": true_predictions.tolist(),
+                                    "prob": true_prob.tolist()})
         return true_boxes, true_predictions, true_prob
 
-    def get_processed_dataframe(self, true_boxes, true_predictions, true_prob):
-        df = self.create_dataframe(true_boxes, true_predictions, true_prob)
-        result_df = self.process_labels(df)
-        return result_df
+    def get_word_labels(self, image, page_words):
+        """Return the label of every word of page_words, "O" for the words without prediction,
+        e.g. the words the tokenizer dropped or truncated away outside of the windowed mode."""
+        image = load_image(image)
+        key = None
+        if self.result_cache is not None:
+            key = self.cache_key(image, "word_labels", page_words)
+            cached = self.result_cache.get(key)
+            if cached is not None:
+                return cached
+        encoding, logits = self.get_batch_predictions([image], [page_words])
+        _, words, predictions, _, _ = self.word_predictions(logits, encoding)
+        labels = np.full(len(page_words[0]), "O", dtype=object)
+        labels[words] = self.label_names[predictions]
+        labels = labels.tolist()
+        if key is not None:
+            self.result_cache.put(key, labels)
+        return labels
+
+    def get_batch_formatted_predictions(self, images, pages_words=None):
+        """Return the true_boxes, true_predictions and true_prob of every image, from one forward pass."""
+        encoding, logits = self.get_batch_predictions(images, pages_words)
+        if self.windowed:
+            return self.merge_windows(logits, encoding, images)
+        formatted = []
+        for i, image in enumerate(images):
+            height, width = image.shape[:2]
+            item_encoding = {key: value[i:i + 1]
+                             for key, value in encoding.items()}
+            formatted.append(self.process_logits(
+                logits[i:i + 1], item_encoding, width, height))
+        return formatted
 
-    def run(self, file_path, save_path=None):
+    def run(self, image, save_path=None):
+        """Annotate an image given as a path, a PIL image or an RGB array, decoding it only once."""
+        image = load_image(image)
+        key = None
+        if self.result_cache is not None:
+            key = self.cache_key(image, "result")
+            # a cached result has no spans left to draw, so saving the annotated image recomputes it
+            cached = None if save_path else self.result_cache.get(key)
+            if cached is not None:
+                return cached
+        page_words = None
+        if self.single_ocr_pass:
+            page_words = self.get_page_words(image)
         true_boxes, true_predictions, true_prob = self.get_formatted_predictions(
-            file_path)
-        df = self.get_processed_dataframe(
-            true_boxes, true_predictions, true_prob)
+            image, page_words)
+        spans = self.get_spans(true_boxes, true_predictions, true_prob)
         result_dict = self.annotate_image(
-            file_path, df, save_path=save_path)
+            image, spans, save_path=save_path, page_words=page_words)
+        if key is not None:
+            self.result_cache.put(key, result_dict)
         return result_dict
 
+    def run_batch(self, images, batch_size=8):
+        """Run the annotator on several images, stacking them into batches for the model.
+
+        The images can be paths, PIL images or RGB arrays. Post-processing is still done image by image
+        and cached results are returned without going through the model.
+        Returns two lists aligned with ``images``: the result dictionaries (None on failure)
+        and the errors (None on success).
+        """
+        results = [None] * len(images)
+        errors = [None] * len(images)
+        keys = [None] * len(images)
+        for start in range(0, len(images), batch_size):
+            indices, batch = [], []
+            for idx in range(start, min(start + batch_size, len(images))):
+                try:
+                    image = load_image(images[idx])
+                    if self.result_cache is not None:
+                        keys[idx] = self.cache_key(image, "result")
+                        results[idx] = self.result_cache.get(keys[idx])
+                        if results[idx] is not None:
+                            continue
+                    batch.append(image)
+                    indices.append(idx)
+                except Exception as e:
+                    errors[idx] = e
+            if not batch:
+                continue
+            try:
+                pages_words = [self.get_page_words(
+                    image) for image in batch] if self.single_ocr_pass else None
+                formatted = self.get_batch_formatted_predictions(
+                    batch, pages_words)
+            except Exception as e:
+                for idx in indices:
+                    errors[idx] = e
+                continue
+            for i, (idx, image) in enumerate(zip(indices, batch)):
+                true_boxes, true_predictions, true_prob = formatted[i]
+                try:
+                    spans = self.get_spans(
+                        true_boxes, true_predictions, true_prob)
+                    results[idx] = self.annotate_image(
+                        image, spans, page_words=pages_words[i] if pages_words else None)
+                    if keys[idx] is not None:
+                        self.result_cache.put(keys[idx], results[idx])
+                except Exception as e:
+                    errors[idx] = e
+        return results, errors
+
 
 if __name__ == "__main__":
     annotator = ImageAnnotator()
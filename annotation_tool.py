@@ -1,16 +1,48 @@
 from textwrap import dedent
+import argparse
 import tkinter as tk
 from tkinter import Tk, filedialog, Label
 from tkinter import messagebox
 from uuid import uuid4
+from itertools import count
+from concurrent.futures import ThreadPoolExecutor
 from PIL import Image, ImageTk
 import json
 import os
 import shutil
+import time
+from spatial_index import GridIndex
+from image_pyramid import ImagePyramid
+from journal import EditJournal
+from document_queue import DocumentQueue
+
+# canvas pixels rendered around the visible region, so that short scrolls show boxes already drawn
+RENDER_MARGIN = 200
+# below this zoom the boxes only show their label, and the "O" boxes no text at all
+LABEL_DETAIL_SCALE = 0.75
+# zoom factor of one step of the zoom buttons or of Control + mouse wheel, and the zoom limits
+ZOOM_STEP = 1.25
+MIN_SCALE = 0.05
+MAX_SCALE = 4.0
+# how often the end of a background save is checked
+SAVE_POLL_MS = 100
+
+
+def write_annotations_file(path, data):
+    # a crash while writing leaves the previous version of the file
+    with open(f'{path}.tmp', "w") as file:
+        json.dump(data, file, indent=4)
+    os.replace(f'{path}.tmp', path)
 
 
 class AnnotationTool:
-    def __init__(self, root: Tk, done_folder: str = "done"):
+    def __init__(self, root: Tk, done_folder: str = "done", tiled: bool = False, queue_dir: str = None,
+                 prefetch: int = 2):
+        # tiled: display the pages from a tiled image pyramid, which can zoom, instead of one full size image.
+        # The tiles are cached in a <image>.tiles folder next to every image
+        self.tiled = tiled
+        # queue mode: the files of queue_dir are shown in order, the next prefetch ones loading in the background
+        self.queue = DocumentQueue(queue_dir, prefetch, tiled) if queue_dir else None
         self.setup_main_window(root)
         self.create_canvas()
         self.create_scrollbars()
@@ -19,6 +51,8 @@ class AnnotationTool:
         self.initialize_annotation_data()
         self.precision = 1e-2
         self.done_folder = done_folder
+        if self.queue is not None:
+            self.next_document()
 
     def setup_main_window(self, root):
         self.root = root
@@ -32,9 +66,9 @@ class AnnotationTool:
 
     def create_scrollbars(self):
         self.x_scroll = tk.Scrollbar(
-            self.canvas_frame, orient="horizontal", command=self.canvas.xview)
+            self.canvas_frame, orient="horizontal", command=self.on_xscroll)
         self.y_scroll = tk.Scrollbar(
-            self.canvas_frame, orient="vertical", command=self.canvas.yview)
+            self.canvas_frame, orient="vertical", command=self.on_yscroll)
         self.canvas.configure(xscrollcommand=self.x_scroll.set,
                               yscrollcommand=self.y_scroll.set)
         self.x_scroll.pack(side=tk.BOTTOM, fill=tk.X)
@@ -49,12 +83,22 @@ class AnnotationTool:
         self.canvas.bind("<ButtonPress-1>", self.on_click)
         self.canvas.bind("<B1-Motion>", self.on_drag)
         self.canvas.bind("<ButtonRelease-1>", self.on_release)
+        self.canvas.bind("<Control-MouseWheel>", self.on_zoom_wheel)
+        self.canvas.bind("<Control-Button-4>", self.on_zoom_wheel)
+        self.canvas.bind("<Control-Button-5>", self.on_zoom_wheel)
+        self.canvas.bind("<Configure>", lambda event: self.schedule_render())
         self.root.bind(
             "<Command-l>", lambda event: self.load_annotations())  # Load
         self.root.bind(
             "<Command-s>", lambda event: self.save_annotations())  # Save
         self.root.bind(
             "<Command-d>", lambda event: self.delete_selected())  # Delete
+        self.root.bind(
+            "<Command-n>", lambda event: self.next_document())  # Next file of the queue
+        self.root.bind(
+            "<Command-plus>", lambda event: self.zoom(ZOOM_STEP))  # Zoom in
+        self.root.bind(
+            "<Command-minus>", lambda event: self.zoom(1 / ZOOM_STEP))  # Zoom out
 
     def setup_annotation_controls(self):
         btn_load = tk.Button(
@@ -69,6 +113,16 @@ class AnnotationTool:
         self.btn_done = tk.Button(
             self.root, text="Done", command=self.move_to_done)
         self.btn_done.pack(side=tk.LEFT)
+        if self.queue is not None:
+            btn_next = tk.Button(
+                self.root, text="Next", command=self.next_document)
+            btn_next.pack(side=tk.LEFT)
+        btn_zoom_in = tk.Button(
+            self.root, text="Zoom In", command=lambda: self.zoom(ZOOM_STEP))
+        btn_zoom_in.pack(side=tk.LEFT)
+        btn_zoom_out = tk.Button(
+            self.root, text="Zoom Out", command=lambda: self.zoom(1 / ZOOM_STEP))
+        btn_zoom_out.pack(side=tk.LEFT)
         label_label = Label(self.root, text="Label:")
         label_label.pack(side=tk.LEFT)
         self.label_entry = tk.Entry(self.root)
@@ -82,11 +136,32 @@ class AnnotationTool:
         self.btn_label = tk.Button(
             self.root, text="Add Annotation", command=self.add_label, state=tk.DISABLED)
         self.btn_label.pack(side=tk.LEFT)
+        # the saves are reported here, they don't interrupt the annotation
+        self.status_label = Label(self.root, text="")
+        self.status_label.pack(side=tk.LEFT)
 
     def initialize_annotation_data(self):
         self.annotations_path = None
         self.img = None
+        # annotations by id, the ids stay the same whether the annotation has canvas items or not
         self.annotations = {}
+        self.ids = count(1)
+        # boxes of self.annotations in image coordinates, for hit-testing without going through the canvas
+        self.index = GridIndex()
+        # canvas items of the annotations in view, and the hidden items left by those scrolled away
+        self.rendered = {}
+        self.item_pool = []
+        self.render_pending = False
+        self.scale = 1.0
+        self.rendered_scale = self.scale
+        # image pyramid of the page in tiled mode, and the tiles on the canvas
+        self.pyramid = None
+        self.tiles = {}
+        # journal of the edits of the file, and the (future, journal, last saved edit) of the saves in progress,
+        # in order: the single thread of the saver writes them one after the other
+        self.journal = None
+        self.saver = ThreadPoolExecutor(max_workers=1)
+        self.pending_saves = []
         self.rect = None
         self.start_x = None
         self.start_y = None
@@ -96,6 +171,15 @@ class AnnotationTool:
         """Reset the UI components to a clean state."""
         self.canvas.delete("all")
         self.annotations = {}
+        self.index.clear()
+        self.rendered = {}
+        self.item_pool = []
+        self.pyramid = None
+        self.tiles = {}
+        self.ids = count(1)
+        if self.journal is not None:
+            self.journal.close()
+        self.journal = None
         self.currently_selected = None
         self.label_entry.delete(0, tk.END)
         self.text_entry.delete(0, tk.END)
@@ -113,6 +197,127 @@ class AnnotationTool:
                 self.canvas.yview_scroll(-1, "units")
             elif event.num == 5 or event.delta < 0:
                 self.canvas.yview_scroll(1, "units")
+        self.schedule_render()
+
+    def on_zoom_wheel(self, event):
+        if event.num == 4 or event.delta > 0:
+            self.zoom(ZOOM_STEP)
+        elif event.num == 5 or event.delta < 0:
+            self.zoom(1 / ZOOM_STEP)
+
+    def zoom(self, factor):
+        """Zoom around the center of the view, only in tiled mode."""
+        if not self.tiled or self.img is None:
+            return
+        scale = min(MAX_SCALE, max(MIN_SCALE, self.scale * factor))
+        width, height = self.canvas.winfo_width(), self.canvas.winfo_height()
+        # the point of the image at the center of the view stays there
+        center_x = self.canvas.canvasx(width / 2) / self.scale
+        center_y = self.canvas.canvasy(height / 2) / self.scale
+        self.scale = scale
+        self.update_scrollregion()
+        self.canvas.xview_moveto(max(0, (center_x * scale - width / 2) / (self.img.width * scale)))
+        self.canvas.yview_moveto(max(0, (center_y * scale - height / 2) / (self.img.height * scale)))
+        self.schedule_render()
+
+    def update_scrollregion(self):
+        self.canvas.config(scrollregion=(0, 0, self.img.width * self.scale, self.img.height * self.scale))
+
+    def on_xscroll(self, *args):
+        self.canvas.xview(*args)
+        self.schedule_render()
+
+    def on_yscroll(self, *args):
+        self.canvas.yview(*args)
+        self.schedule_render()
+
+    def schedule_render(self):
+        """Render the viewport once the pending events are handled, so a burst of scrolls renders once."""
+        if not self.render_pending:
+            self.render_pending = True
+            self.root.after_idle(self.render_viewport)
+
+    def visible_region(self):
+        """Return the visible part of the canvas plus RENDER_MARGIN, in image coordinates."""
+        x1 = self.canvas.canvasx(0) - RENDER_MARGIN
+        y1 = self.canvas.canvasy(0) - RENDER_MARGIN
+        x2 = self.canvas.canvasx(self.canvas.winfo_width()) + RENDER_MARGIN
+        y2 = self.canvas.canvasy(self.canvas.winfo_height()) + RENDER_MARGIN
+        return x1 / self.scale, y1 / self.scale, x2 / self.scale, y2 / self.scale
+
+    def render_viewport(self):
+        """Give canvas items to the annotations in view and recycle the items of the others."""
+        self.render_pending = False
+        if self.pyramid is not None:
+            self.render_tiles()
+        visible = set(self.index.query_rect(*self.visible_region()))
+        # the selected annotation keeps its items while it is being edited
+        if self.currently_selected in self.annotations:
+            visible.add(self.currently_selected)
+        for annotation_id in [annotation_id for annotation_id in self.rendered if annotation_id not in visible]:
+            self.release_items(annotation_id)
+        # after a zoom the items kept have to be moved and their labels changed too
+        redraw = visible if self.scale != self.rendered_scale else visible - self.rendered.keys()
+        self.rendered_scale = self.scale
+        for annotation_id in sorted(redraw):
+            self.draw_item(annotation_id)
+
+    def render_tiles(self):
+        """Show the tiles in view of the pyramid level matching the zoom, and drop the others."""
+        level = self.pyramid.level_for(self.scale)
+        factor = 2 ** level
+        x1, y1, x2, y2 = (coordinate / factor for coordinate in self.visible_region())
+        visible = {(level, col, row, self.scale)
+                   for col, row in self.pyramid.tiles_in(level, x1, y1, x2, y2)}
+        for key in [key for key in self.tiles if key not in visible]:
+            self.canvas.delete(self.tiles.pop(key)[0])
+        for key in sorted(visible - self.tiles.keys()):
+            level, col, row, scale = key
+            left, top, right, bottom = (round(coordinate * scale)
+                                        for coordinate in self.pyramid.tile_box(level, col, row))
+            tile = self.pyramid.tile(level, col, row)
+            size = (max(1, right - left), max(1, bottom - top))
+            if tile.size != size:
+                tile = tile.resize(size, Image.Resampling.BILINEAR)
+            photo = ImageTk.PhotoImage(tile)
+            self.tiles[key] = (self.canvas.create_image(left, top, anchor=tk.NW, image=photo, tags="tile"), photo)
+        # the boxes stay above the tiles
+        self.canvas.tag_lower("tile")
+
+    def release_items(self, annotation_id):
+        """Hide the canvas items of an annotation and put them back in the pool."""
+        items = self.rendered.pop(annotation_id, None)
+        if items:
+            for item in items:
+                self.canvas.itemconfig(item, state='hidden')
+            self.item_pool.append(items)
+
+    def draw_item(self, annotation_id):
+        """Draw an annotation with its canvas items, taken from the pool when it has none."""
+        if annotation_id not in self.rendered:
+            if self.item_pool:
+                self.rendered[annotation_id] = self.item_pool.pop()
+            else:
+                self.rendered[annotation_id] = (
+                    self.canvas.create_rectangle(0, 0, 0, 0, outline='red', tags="rectangle"),
+                    self.canvas.create_text(0, 0, anchor='nw', font=("Purisa", 10), fill="blue"))
+        rect_id, text_id = self.rendered[annotation_id]
+        value = self.annotations[annotation_id]['value']
+        x1, y1, x2, y2 = (coordinate * self.scale for coordinate in self.calculate_bbox_coordinates(value))
+        self.canvas.coords(rect_id, x1, y1, x2, y2)
+        self.canvas.itemconfig(
+            rect_id, state='normal', outline='green' if annotation_id == self.currently_selected else 'red')
+        text = self.annotation_text(value)
+        self.canvas.coords(text_id, x1, y1 - 12)
+        self.canvas.itemconfig(text_id, text=text, state='normal' if text else 'hidden')
+
+    def annotation_text(self, value):
+        """Text of the label of a box, with less detail when zoomed out."""
+        if 'label' not in value or 'text' not in value:
+            return ''
+        if self.scale >= LABEL_DETAIL_SCALE:
+            return dedent(f"{value['text']} ({value['label']})")
+        return value['label'] if value['label'] != 'O' else ''
 
     def load_annotations(self):
         """Load annotations by asking user for file, reading it, and displaying annotations."""
@@ -128,28 +333,86 @@ class AnnotationTool:
     def refresh_annotations(self):
         """Refresh the annotations on the canvas."""
         if self.annotations_path:
+            # a save in progress could still be writing the file or compacting its journal
+            self.check_save(wait=True)
             annotations = self.read_annotation_data(self.annotations_path)
-            self.reset_ui()
-            self.display_image_and_annotations(annotations)
+            self.show_annotations(annotations)
         else:
             messagebox.showerror("Could not reload annotations")
 
+    def show_annotations(self, annotations, pyramid=None):
+        """Display the image and the annotations read from self.annotations_path, with its unsaved edits."""
+        self.reset_ui()
+        self.display_image_and_annotations(annotations, pyramid)
+        self.journal = EditJournal(self.annotations_path)
+        edits = self.journal.read()
+        if edits:
+            self.replay_edits(edits)
+            messagebox.showinfo("Recovered Edits", f"{len(edits)} unsaved edits restored from the journal")
+
+    def next_document(self):
+        """Show the next file of the queue, which was loaded in the background while the current one was shown."""
+        if self.queue is None:
+            return
+        self.check_save(wait=True)
+        self.queue.view = (self.scale, self.canvas.winfo_width(), self.canvas.winfo_height())
+        try:
+            document = self.queue.next()
+            if document is None:
+                self.reset_ui()
+                messagebox.showinfo("Queue", f"No more files to annotate in {self.queue.todo_dir}")
+                return
+            self.annotations_path = document['path']
+            self.image_path = document['data']['data']['ocr']
+            self.img = document['image']
+            self.show_annotations(document['data']['predictions'][0]['result'], document['pyramid'])
+        except Exception as e:
+            messagebox.showerror("Error Loading Annotations", str(e))
+
     def read_annotation_data(self, path):
         """Read and return annotation data from the specified file path."""
         with open(path, 'r') as file:
             self.annotations_path = path
             data = json.load(file)
             self.image_path = data['data']['ocr']
-            self.img = Image.open(self.image_path)
+            with Image.open(self.image_path) as self.img:
+                # the tiles are decoded from the pyramid, only the size of the image is needed
+                if not self.tiled:
+                    self.img.load()
             annotations = data['predictions'][0]['result']
             return annotations
 
-    def display_image_and_annotations(self, annotations):
+    def replay_edits(self, edits):
+        """Apply the edits of the journal to the annotations loaded from the file."""
+        ids = {annotation['region_id']: annotation_id for annotation_id, annotation in self.annotations.items()}
+        for edit in edits:
+            annotation_id = ids.get(edit['region'])
+            if edit['op'] == 'set':
+                if annotation_id is None:
+                    annotation_id = ids[edit['region']] = next(self.ids)
+                self.annotations[annotation_id] = {
+                    'id': annotation_id, 'region_id': edit['region'], 'value': edit['value']}
+                self.index.insert(annotation_id, self.calculate_bbox_coordinates(edit['value']))
+                if annotation_id in self.rendered:
+                    self.draw_item(annotation_id)
+            elif edit['op'] == 'delete' and annotation_id is not None:
+                del ids[edit['region']]
+                self.release_items(annotation_id)
+                del self.annotations[annotation_id]
+                self.index.remove(annotation_id)
+        self.schedule_render()
+
+    def display_image_and_annotations(self, annotations, pyramid=None):
         """Display the image on the canvas and draw the loaded annotations."""
         try:
-            self.tk_img = ImageTk.PhotoImage(self.img)
-            self.canvas.create_image(0, 0, anchor=tk.NW, image=self.tk_img)
-            self.canvas.config(scrollregion=self.canvas.bbox(tk.ALL))
+            if self.tiled:
+                # built on the first display of the image only, the tiles are then read from disk
+                self.pyramid = pyramid or ImagePyramid(self.image_path)
+                self.pyramid.build()
+            else:
+                self.tk_img = ImageTk.PhotoImage(self.img)
+                self.canvas.create_image(0, 0, anchor=tk.NW, image=self.tk_img)
+            self.update_scrollregion()
             self.draw_annotations(annotations)
         except Exception as e:
             raise RuntimeError("Failed to display annotations: " + str(e))
@@ -159,22 +422,15 @@ class AnnotationTool:
         for item in annotations:
             if item['type'] == 'textarea':
                 self.draw_text_area_annotation(item)
+        self.render_viewport()
 
     def draw_text_area_annotation(self, item):
-        """Draw a text area annotation based on its description."""
+        """Add a text area annotation, its canvas items are created once it is in view."""
         bbox = item['value']
-        x1, y1, x2, y2 = self.calculate_bbox_coordinates(bbox)
-        rect_id = self.canvas.create_rectangle(
-            x1, y1, x2, y2, outline='red', tags="rectangle")
-        text_x, text_y = x1, y1 - 12
-        text_id = self.canvas.create_text(
-            text_x, text_y, anchor='nw', text=dedent(f"{bbox['text']} ({bbox['label']})"),
-            font=("Purisa", 10), fill="blue"
-        )
-        self.annotations[rect_id] = {
-            'rect_id': rect_id, 'text_id': text_id,
-            'value': bbox, 'text': bbox['text'], 'label': bbox['label']
-        }
+        annotation_id = next(self.ids)
+        self.annotations[annotation_id] = {
+            'id': annotation_id, 'region_id': item.get('id') or str(uuid4())[:10], 'value': bbox}
+        self.index.insert(annotation_id, self.calculate_bbox_coordinates(bbox))
 
     def calculate_bbox_coordinates(self, bbox):
         """Calculate and return bounding box coordinates based on image dimensions."""
@@ -188,23 +444,25 @@ class AnnotationTool:
         self.start_x = self.canvas.canvasx(event.x)
         self.start_y = self.canvas.canvasy(event.y)
         self.rect = None
-        for rect in self.canvas.find_withtag("rectangle"):
-            x1, y1, x2, y2 = self.canvas.coords(rect)
-            if x1 <= self.start_x <= x2 and y1 <= self.start_y <= y2:
-                if self.currently_selected:
-                    self.deselect_current()
-                self.currently_selected = rect
-                self.canvas.itemconfig(rect, outline='green')
-                self.btn_label.config(state=tk.NORMAL)
-                self.btn_delete.config(state=tk.NORMAL)
-                annotation_data = self.annotations[self.currently_selected]['value']
-                if annotation_data:
-                    self.label_entry.delete(0, tk.END)
-                    self.label_entry.insert(
-                        0, annotation_data['label'])
-                    self.text_entry.delete(0, tk.END)
-                    self.text_entry.insert(0, annotation_data['text'])
-                return
+        hits = self.index.query_point(self.start_x / self.scale, self.start_y / self.scale)
+        if hits and self.currently_selected:
+            self.deselect_current()
+            # deselecting drops a box without label
+            hits = [rect for rect in hits if rect in self.annotations]
+        if hits:
+            # the first box drawn wins when several contain the click
+            self.currently_selected = hits[0]
+            self.draw_item(self.currently_selected)
+            self.btn_label.config(state=tk.NORMAL)
+            self.btn_delete.config(state=tk.NORMAL)
+            annotation_data = self.annotations[self.currently_selected]['value']
+            if annotation_data:
+                self.label_entry.delete(0, tk.END)
+                self.label_entry.insert(
+                    0, annotation_data['label'])
+                self.text_entry.delete(0, tk.END)
+                self.text_entry.insert(0, annotation_data['text'])
+            return
         if self.currently_selected:
             self.deselect_current()
 
@@ -222,21 +480,27 @@ class AnnotationTool:
 
     def on_release(self, event):
         if self.rect:
-            if self.rect not in self.annotations:
-                bbox = self.format_bbox({
-                    'x': self.start_x * 100 / self.img.width,
-                    'y': self.start_y * 100 / self.img.height,
-                    'width': (self.canvas.canvasx(event.x) - self.start_x) * 100 / self.img.width,
-                    'height': (self.canvas.canvasy(event.y) - self.start_y) * 100 / self.img.height,
-                    'rotation': 0
-                })
-                self.annotations[self.rect] = {
-                    'rect_id': self.rect, 'text_id': None, 'value': bbox}
-            self.canvas.itemconfig(self.rect, outline='green')
+            # the canvas is the image scaled by self.scale
+            width, height = self.img.width * self.scale, self.img.height * self.scale
+            bbox = self.format_bbox({
+                'x': self.start_x * 100 / width,
+                'y': self.start_y * 100 / height,
+                'width': (self.canvas.canvasx(event.x) - self.start_x) * 100 / width,
+                'height': (self.canvas.canvasy(event.y) - self.start_y) * 100 / height,
+                'rotation': 0
+            })
+            # the rectangle drawn while dragging is replaced by the items of the new annotation
+            self.canvas.delete(self.rect)
+            self.rect = None
+            annotation_id = next(self.ids)
+            self.annotations[annotation_id] = {
+                'id': annotation_id, 'region_id': str(uuid4())[:10], 'value': bbox}
+            self.index.insert(annotation_id, self.calculate_bbox_coordinates(bbox))
             self.btn_label.config(state=tk.NORMAL)
             self.btn_delete.config(state=tk.NORMAL)
             self.label_entry.focus_set()
-            self.currently_selected = self.rect
+            self.currently_selected = annotation_id
+            self.draw_item(annotation_id)
 
     def format_bbox(self, bbox):
         x1 = bbox['x']
@@ -258,10 +522,11 @@ class AnnotationTool:
         if self.currently_selected and self.label_entry.get().strip() and self.text_entry.get().strip():
             label = self.label_entry.get().strip().upper()
             text = self.text_entry.get().strip()
-            coords = self.canvas.coords(self.currently_selected)
             self.annotations[self.currently_selected]['value']['label'] = label
             self.annotations[self.currently_selected]['value']['text'] = text
-            self.update_canvas_text(coords, f"{text} ({label})")
+            self.journal.append('set', region=self.annotations[self.currently_selected]['region_id'],
+                                value=self.annotations[self.currently_selected]['value'])
+            # deselecting redraws the box with its new label
             self.label_entry.delete(0, tk.END)
             self.text_entry.delete(0, tk.END)
             self.deselect_current()
@@ -269,21 +534,15 @@ class AnnotationTool:
             messagebox.showerror(
                 "Error", "Please make sure a rectangle is selected and text fields are not empty.")
 
-    def update_canvas_text(self, coords, text):
-        text_id = self.annotations[self.currently_selected]['text_id']
-        if text_id:
-            self.canvas.delete(text_id)
-        new_text_id = self.canvas.create_text(
-            coords[0], coords[1] - 12, anchor='nw', text=text, font=("Purisa", 10), fill="blue")
-        self.annotations[self.currently_selected]['text_id'] = new_text_id
-
     def deselect_current(self):
         if self.currently_selected:
-            if "label" in self.annotations[self.currently_selected]['value'] and "text" in self.annotations[self.currently_selected]['value']:
-                self.canvas.itemconfig(self.currently_selected, outline='red')
+            selected, self.currently_selected = self.currently_selected, None
+            if "label" in self.annotations[selected]['value'] and "text" in self.annotations[selected]['value']:
+                self.draw_item(selected)
             else:
-                self.annotations.pop(self.currently_selected)
-                self.canvas.delete(self.currently_selected)
+                self.annotations.pop(selected)
+                self.index.remove(selected)
+                self.release_items(selected)
         self.currently_selected = None
         self.btn_label.config(state=tk.DISABLED)
         self.btn_delete.config(state=tk.DISABLED)
@@ -291,12 +550,10 @@ class AnnotationTool:
     def delete_selected(self):
         if self.currently_selected:
             if self.currently_selected in self.annotations:
-                label_id = self.annotations[self.currently_selected].get(
-                    'text_id')
-                if label_id:
-                    self.canvas.delete(label_id)
-                self.canvas.delete(self.currently_selected)
+                self.journal.append('delete', region=self.annotations[self.currently_selected]['region_id'])
+                self.release_items(self.currently_selected)
                 del self.annotations[self.currently_selected]
+                self.index.remove(self.currently_selected)
             self.currently_selected = None
             self.btn_label.config(state=tk.DISABLED)
             self.btn_delete.config(state=tk.DISABLED)
@@ -320,7 +577,7 @@ class AnnotationTool:
     def format_single_annotation(self, annotation):
         """Format a single annotation into the required dictionary format for bbox and transcription."""
         annot_value = annotation['value']
-        region_id = str(uuid4())[:10]
+        region_id = annotation['region_id']
         bbox = {key: annot_value[key] for key in ['x', 'y', 'width', 'height']}
         bbox['rotation'] = 0
 
@@ -336,30 +593,69 @@ class AnnotationTool:
         ]
 
     def save_annotations(self):
-        """Saves the annotations to a file."""
+        """Saves the annotations to a file, in the background. The edits stay in the journal until it is written."""
         if self.annotations:
             formatted_annotations = self.format_annotations()
-            with open(self.annotations_path, "w") as file:
-                json.dump(formatted_annotations, file, indent=4)
-            messagebox.showinfo("Success", "Annotations saved!")
-            self.refresh_annotations()
+            if not self.pending_saves:
+                self.root.after(SAVE_POLL_MS, self.check_save)
+            self.pending_saves.append((
+                self.saver.submit(write_annotations_file, self.annotations_path, formatted_annotations),
+                self.journal, self.journal.seq))
+            self.status_label.config(text="Saving...")
         else:
             messagebox.showerror("Save Error", "No annotations to save.")
 
+    def check_save(self, wait=False):
+        """Report the end of the saves in progress, in order, and compact the journal once a file is written."""
+        while self.pending_saves:
+            future, journal, saved_seq = self.pending_saves[0]
+            if not future.done() and not wait:
+                self.root.after(SAVE_POLL_MS, self.check_save)
+                return
+            self.pending_saves.pop(0)
+            try:
+                future.result()
+            except Exception as e:
+                self.status_label.config(text="Save failed")
+                messagebox.showerror("Save Error", str(e))
+                continue
+            journal.compact(saved_seq)
+            self.status_label.config(text=f"Saved at {time.strftime('%H:%M:%S')}")
+
     def move_to_done(self):
         """Move the selected annotation file to the done folder."""
         if self.annotations_path:
+            self.check_save(wait=True)
+            # the edits not saved yet go into the file, done/ only holds annotations files
+            if self.journal is not None and self.journal.pending:
+                write_annotations_file(self.annotations_path, self.format_annotations())
+                self.journal.compact(self.journal.seq)
             done_path = os.path.join(
                 self.done_folder, os.path.basename(self.annotations_path))
             os.makedirs(self.done_folder, exist_ok=True)
             shutil.move(self.annotations_path, done_path)
-            messagebox.showinfo("Success", f"Moved to {self.done_folder}")
             self.reset_ui()
+            if self.queue is not None:
+                # no message to dismiss, the next file is shown right away
+                self.next_document()
+            else:
+                messagebox.showinfo("Success", f"Moved to {self.done_folder}")
         else:
             messagebox.showerror("Move Error", "No file to move.")
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Annotate the OCR boxes of the pages.")
+    parser.add_argument("--queue", metavar="TODO_DIR",
+                        help="show the files of TODO_DIR one after the other instead of picking them")
+    parser.add_argument("--prefetch", type=int, default=2,
+                        help="number of files of the queue loaded in advance")
+    parser.add_argument("--done", default="done")
+    parser.add_argument("--tiled", action="store_true",
+                        help="display large scans from tiles cached next to the images, with zoom")
+    args = parser.parse_args()
+
     root = tk.Tk()
-    app = AnnotationTool(root)
+    app = AnnotationTool(root, done_folder=args.done, tiled=args.tiled, queue_dir=args.queue,
+                         prefetch=args.prefetch)
     root.mainloop()
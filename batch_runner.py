@@ -0,0 +1,209 @@
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack
+from tqdm import tqdm
+from cache import file_digest
+
+MANIFEST_NAME = 'manifest.jsonl'
+
+# annotator of a worker process, created once by init_worker
+_annotator = None
+
+
+def write_json_atomically(path, data):
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def image_stat(path):
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def init_worker(annotator_kwargs):
+    global _annotator
+    from Inference import ImageAnnotator
+    _annotator = ImageAnnotator(**annotator_kwargs)
+
+
+def annotate_chunk(image_paths, annotator=None):
+    """Return (result, error message, seconds per image) for each image of the chunk."""
+    annotator = annotator or _annotator
+    start = time.perf_counter()
+    results, errors = annotator.run_batch(image_paths, batch_size=len(image_paths))
+    seconds = (time.perf_counter() - start) / len(image_paths)
+    return [(result, None if error is None else f'{type(error).__name__}: {error}', seconds)
+            for result, error in zip(results, errors)]
+
+
+class BatchRunner:
+    """Annotates a folder of images and records every outcome in an append-only manifest.
+
+    Each line of results/manifest.jsonl holds the image hash, size and mtime, the model
+    fingerprint, the status, the time spent and the error of one image; the last line of an
+    image wins. An image is annotated again only if it changed, the model changed, it failed
+    or its result is missing, so an interrupted job restarts where it stopped. Only the images
+    whose size or mtime changed are hashed again.
+    Without a manifest, the results already in results_dir are taken as done with the current model.
+    The exact duplicates found by dedup.py get a copy of the result of their canonical page.
+    """
+
+    def __init__(self, image_dir, results_dir, workers=1, batch_size=8, annotator_kwargs=None,
+                 duplicates=None):
+        from Inference import ImageAnnotator
+        self.image_dir = image_dir
+        self.results_dir = results_dir
+        self.workers = workers
+        self.batch_size = batch_size
+        self.annotator_kwargs = annotator_kwargs or {}
+        self.duplicates = duplicates or {}
+        self.reused = 0
+        # [size, mtime_ns] of the images when they were hashed by pending
+        self.stats = {}
+        # the model itself is only loaded on the first prediction
+        self.annotator = ImageAnnotator(**self.annotator_kwargs)
+        self.manifest_path = os.path.join(results_dir, MANIFEST_NAME)
+        os.makedirs(results_dir, exist_ok=True)
+        self.manifest = self.load_manifest()
+
+    def result_path(self, image):
+        return os.path.join(self.results_dir, image.replace('.png', '.json'))
+
+    def load_manifest(self):
+        manifest = {}
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # last line cut by a crash
+                        continue
+                    manifest[entry['image']] = entry
+        else:
+            manifest = self.seed_manifest()
+        return manifest
+
+    def seed_manifest(self):
+        """Record the results written before the manifest existed, so they are not computed again."""
+        manifest = {}
+        for image in sorted(os.listdir(self.image_dir)):
+            if image.endswith('.png') and os.path.exists(self.result_path(image)):
+                image_path = os.path.join(self.image_dir, image)
+                size, mtime_ns = image_stat(image_path)
+                manifest[image] = {'image': image, 'image_hash': file_digest(image_path),
+                                   'size': size, 'mtime_ns': mtime_ns,
+                                   'model_fingerprint': self.annotator.fingerprint(),
+                                   'status': 'done', 'seconds': 0, 'error': None, 'updated': time.time()}
+        if manifest:
+            self.manifest = manifest
+            self.compact_manifest()
+        return manifest
+
+    def compact_manifest(self):
+        """Rewrite the manifest with one line per image."""
+        tmp_path = f'{self.manifest_path}.tmp'
+        with open(tmp_path, 'w') as f:
+            for image in sorted(self.manifest):
+                f.write(json.dumps(self.manifest[image]) + '\n')
+        os.replace(tmp_path, self.manifest_path)
+
+    def is_up_to_date(self, image, image_hash):
+        entry = self.manifest.get(image)
+        return (entry is not None and entry['status'] == 'done'
+                and entry['image_hash'] == image_hash
+                and entry['model_fingerprint'] == self.annotator.fingerprint()
+                and os.path.exists(self.result_path(image)))
+
+    def pending(self):
+        """Return the (image, hash) pairs that are new, stale or failed."""
+        pending = []
+        for image in sorted(os.listdir(self.image_dir)):
+            if not image.endswith('.png'):
+                continue
+            image_path = os.path.join(self.image_dir, image)
+            self.stats[image] = image_stat(image_path)
+            entry = self.manifest.get(image)
+            if entry is not None and [entry.get('size'), entry.get('mtime_ns')] == self.stats[image]:
+                image_hash = entry['image_hash']
+            else:
+                image_hash = file_digest(image_path)
+            if not self.is_up_to_date(image, image_hash):
+                pending.append((image, image_hash))
+        return pending
+
+    def record(self, manifest_file, image, image_hash, result, error, seconds, **extra):
+        result_path = self.result_path(image)
+        if error is None:
+            write_json_atomically(result_path, result)
+        elif os.path.exists(result_path):
+            # the result of the previous version of the image would be stale
+            os.remove(result_path)
+        size, mtime_ns = self.stats.get(image) or image_stat(os.path.join(self.image_dir, image))
+        entry = {'image': image, 'image_hash': image_hash, 'size': size, 'mtime_ns': mtime_ns,
+                 'model_fingerprint': self.annotator.fingerprint(),
+                 'status': 'done' if error is None else 'failed',
+                 'seconds': round(seconds, 3), 'error': error, 'updated': time.time(), **extra}
+        self.manifest[image] = entry
+        manifest_file.write(json.dumps(entry) + '\n')
+
+    def run(self, pending=None):
+        """Annotate the pending images and return the failed ones as (image, error) pairs."""
+        if pending is None:
+            pending = self.pending()
+        # the canonical pages go first so that their duplicates can reuse their results
+        errors = self.annotate([(image, image_hash) for image, image_hash in pending
+                                if image not in self.duplicates])
+        errors += self.annotate(self.reuse_duplicates(
+            [(image, image_hash) for image, image_hash in pending if image in self.duplicates]))
+        self.compact_manifest()
+        return errors
+
+    def reuse_duplicates(self, pending):
+        """Copy the result of the canonical page of the duplicates, return the ones left to annotate."""
+        remaining = []
+        with open(self.manifest_path, 'a') as manifest_file:
+            for image, image_hash in pending:
+                canonical = self.duplicates[image]
+                entry = self.manifest.get(canonical)
+                if entry is None or not self.is_up_to_date(canonical, entry['image_hash']):
+                    remaining.append((image, image_hash))
+                    continue
+                with open(self.result_path(canonical)) as f:
+                    result = json.load(f)
+                self.record(manifest_file, image, image_hash, result, None, 0, duplicate_of=canonical)
+                self.reused += 1
+        return remaining
+
+    def annotate(self, pending):
+        if not pending:
+            return []
+        chunks = [pending[start:start + self.batch_size]
+                  for start in range(0, len(pending), self.batch_size)]
+        image_chunks = [[os.path.join(self.image_dir, image) for image, _ in chunk]
+                        for chunk in chunks]
+        errors = []
+        with ExitStack() as stack:
+            if self.workers > 1:
+                executor = stack.enter_context(ProcessPoolExecutor(
+                    self.workers, initializer=init_worker, initargs=(self.annotator_kwargs,)))
+                outcomes = executor.map(annotate_chunk, image_chunks)
+            else:
+                outcomes = (annotate_chunk(image_paths, self.annotator)
+                            for image_paths in image_chunks)
+            manifest_file = stack.enter_context(open(self.manifest_path, 'a'))
+            progress_bar = stack.enter_context(
+                tqdm(total=len(pending), desc="Annotating images"))
+            for chunk, chunk_outcomes in zip(chunks, outcomes):
+                for (image, image_hash), (result, error, seconds) in zip(chunk, chunk_outcomes):
+                    self.record(manifest_file, image, image_hash, result, error, seconds)
+                    if error is not None:
+                        errors.append((image, error))
+                # a crash loses at most the chunk being annotated
+                manifest_file.flush()
+                progress_bar.update(len(chunk))
+        return errors
@@ -0,0 +1,241 @@
+import os
+import subprocess
+import sys
+import time
+import numpy as np
+import pandas as pd
+import torch
+from Inference import ImageAnnotator, load_image
+
+
+def benchmark_run(annotator, image_paths):
+    """Time the one-image-at-a-time ``run`` loop and return the throughput in images/sec."""
+    start = time.perf_counter()
+    for image_path in image_paths:
+        try:
+            annotator.run(image_path)
+        except Exception:
+            pass
+    elapsed = time.perf_counter() - start
+    return len(image_paths) / elapsed
+
+
+def benchmark_run_batch(annotator, image_paths, batch_size):
+    """Time ``run_batch`` over the same images and return the throughput in images/sec."""
+    start = time.perf_counter()
+    annotator.run_batch(image_paths, batch_size=batch_size)
+    elapsed = time.perf_counter() - start
+    return len(image_paths) / elapsed
+
+
+def legacy_spans(annotator, logits, encoding, width, height):
+    """The list comprehension and pandas post-processing used before the NumPy version, kept as reference."""
+    predictions = logits.argmax(-1).squeeze().tolist()
+    offset_mapping = encoding['offset_mapping'].squeeze().tolist()
+    is_subword = np.array([offset[0] != 0 for offset in offset_mapping])
+    true_predictions = [pred for idx, pred in enumerate(
+        predictions) if not is_subword[idx]]
+    true_boxes = [box for idx, box in enumerate(
+        encoding['bbox'].squeeze().tolist()) if not is_subword[idx]]
+    true_boxes = np.array(true_boxes)
+    true_boxes[:, [0, 2]] = true_boxes[:, [0, 2]] * width / 1000
+    true_boxes[:, [1, 3]] = true_boxes[:, [1, 3]] * height / 1000
+
+    data = []
+    for box, label_id in zip(true_boxes, true_predictions):
+        label = annotator.id2label[int(label_id)]
+        if label != "O" and box[0] != box[2]:
+            data.append({'start': (int(box[0]), int(box[1])),
+                         'end': (int(box[2]), int(box[3])), 'label': label})
+    if data == []:
+        raise ValueError("No labels detected in the image")
+    df = pd.DataFrame(data)
+    df['block'] = (df['label'].str.startswith('B')).cumsum()
+    result_df = df.groupby('block').agg(
+        {'start': 'first', 'end': 'last', 'label': 'first'}).reset_index(drop=True)
+    result_df['label'] = result_df['label'].str[2:]
+    return [(*row['start'], *row['end'], row['label']) for _, row in result_df.iterrows()]
+
+
+def random_page(num_labels, max_length=256, seed=0):
+    """Random logits and encoding shaped like the output of ImageAnnotator.get_predictions."""
+    rng = np.random.default_rng(seed)
+    logits = torch.tensor(rng.normal(
+        size=(1, max_length, num_labels)), dtype=torch.float32)
+    # roughly one token in three is a subword
+    offsets = np.zeros((1, max_length, 2), dtype=np.int64)
+    offsets[0, :, 0] = (rng.random(max_length) < 0.3) * 2
+    corners = rng.integers(0, 900, size=(1, max_length, 2))
+    sizes = rng.integers(0, 100, size=(1, max_length, 2))
+    bbox = np.concatenate([corners, corners + sizes], axis=-1)
+    return logits, {'offset_mapping': torch.tensor(offsets), 'bbox': torch.tensor(bbox)}
+
+
+def benchmark_postprocessing(annotator, num_pages=200, width=2480, height=3508):
+    """Check the NumPy post-processing against the legacy one and time both, in pages/sec."""
+    pages = [random_page(len(annotator.id2label), seed=seed)
+             for seed in range(num_pages)]
+    for logits, encoding in pages:
+        expected_spans = legacy_spans(
+            annotator, logits, encoding, width, height)
+        true_boxes, true_predictions, true_prob = annotator.process_logits(
+            logits, encoding, width, height)
+        spans = list(annotator.get_spans(
+            true_boxes, true_predictions, true_prob))
+        if spans != expected_spans:
+            # not an assert, the check has to run under python -O too
+            raise AssertionError("Spans differ from the legacy post-processing")
+
+    start = time.perf_counter()
+    for logits, encoding in pages:
+        legacy_spans(annotator, logits, encoding, width, height)
+    legacy_throughput = num_pages / (time.perf_counter() - start)
+    start = time.perf_counter()
+    for logits, encoding in pages:
+        annotator.get_spans(
+            *annotator.process_logits(logits, encoding, width, height))
+    throughput = num_pages / (time.perf_counter() - start)
+    return legacy_throughput, throughput
+
+
+def benchmark_model_backends(image_paths, batch_size, num_threads=None):
+    """Compare the forward pass of the torch and ONNX Runtime backends on the same encodings.
+
+    Prints the latency at batch size 1, the throughput at ``batch_size`` and the largest logit difference.
+    """
+    annotators = {"torch": ImageAnnotator(num_threads=num_threads, ocr_cache_dir=None),
+                  "onnx": ImageAnnotator(model_backend="onnx", num_threads=num_threads, ocr_cache_dir=None)}
+    images = [load_image(image_path) for image_path in image_paths]
+    # the processor output is the same for both backends, it is not part of the measure
+    encoder = annotators["torch"]
+    single_encodings = [encoder.encode([image]) for image in images]
+    batch_encodings = [encoder.encode(images[i:i + batch_size])
+                       for i in range(0, len(images), batch_size)]
+
+    logits = {}
+    for name, annotator in annotators.items():
+        logits[name] = annotator.model(single_encodings[0])
+        latencies = []
+        for encoding in single_encodings:
+            start = time.perf_counter()
+            annotator.model(encoding)
+            latencies.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        for encoding in batch_encodings:
+            annotator.model(encoding)
+        throughput = len(images) / (time.perf_counter() - start)
+        print(f"{name}: p50 latency {np.percentile(latencies, 50) * 1000:.1f} ms, "
+              f"p90 latency {np.percentile(latencies, 90) * 1000:.1f} ms, "
+              f"{throughput:.2f} images/sec at batch size {batch_size}")
+    print(
+        f"max logit difference: {np.abs(logits['torch'] - logits['onnx']).max():.2e}")
+
+
+def synthetic_page(num_words, width=2480, height=3508, seed=0):
+    """Blank page with random words laid out in lines, shaped like the output of get_page_words."""
+    rng = np.random.default_rng(seed)
+    words, boxes = [], []
+    words_per_line = 12
+    line_height = max(1, height // (num_words // words_per_line + 2))
+    for i in range(num_words):
+        left = (i % words_per_line) * width // words_per_line
+        top = (i // words_per_line) * line_height
+        words.append("".join(rng.choice(list("abcdefghijklmnopqrstuvwxyz0123456789"), size=rng.integers(2, 10))))
+        boxes.append([left, top, left + width // (words_per_line + 2), top + line_height // 2])
+    return np.full((height, width, 3), 255, dtype=np.uint8), (words, boxes)
+
+
+def benchmark_windowed(word_counts, repeats=3):
+    """Time a page as its number of words grows, truncated at 256 tokens and with 256/512-token windows."""
+    annotators = {
+        "truncated 256": ImageAnnotator(single_ocr_pass=True, result_cache=False, ocr_cache_dir=None),
+        "windows 256": ImageAnnotator(windowed=True, max_length=256, window_stride=64, result_cache=False,
+                                      ocr_cache_dir=None),
+        "windows 512": ImageAnnotator(windowed=True, max_length=512, window_stride=128, result_cache=False,
+                                      ocr_cache_dir=None),
+    }
+    for num_words in word_counts:
+        image, page_words = synthetic_page(num_words)
+        for name, annotator in annotators.items():
+            num_windows = len(annotator.encode(
+                [image], [page_words])['input_ids'])
+            start = time.perf_counter()
+            for _ in range(repeats):
+                annotator.get_batch_formatted_predictions(
+                    [image], [page_words])
+            elapsed = (time.perf_counter() - start) / repeats
+            print(f"{num_words} words, {name}: {num_windows} windows, "
+                  f"{elapsed * 1000:.0f} ms/page")
+
+
+HEAVY_MODULES = ["torch", "transformers", "cv2", "pytesseract", "pandas", "onnxruntime"]
+
+
+def time_python(code):
+    """Run code in a fresh interpreter and return its wall time and output."""
+    start = time.perf_counter()
+    output = subprocess.run([sys.executable, "-c", code], check=True,
+                            capture_output=True, text=True).stdout
+    return time.perf_counter() - start, output.strip()
+
+
+def benchmark_startup(image_path):
+    """Time the imports of the entry points and the time to the first prediction of a fresh process.
+
+    Returns False if annotation_tool.py pulled in any of the heavy modules.
+    """
+    loaded = f"import sys; print(','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+    ok = True
+    for module in ["Inference", "extract_inferences", "annotation_tool"]:
+        elapsed, heavy_modules = time_python(f"import {module}; {loaded}")
+        print(f"import {module}: {elapsed * 1000:.0f} ms, heavy modules: {heavy_modules or 'none'}")
+        if module == "annotation_tool" and heavy_modules:
+            print("annotation_tool.py must not import the ML stack")
+            ok = False
+    elapsed, _ = time_python(
+        f"from Inference import ImageAnnotator; ImageAnnotator(result_cache=False, ocr_cache_dir=None).run({image_path!r})")
+    print(f"time to first prediction: {elapsed:.2f}s")
+    return ok
+
+
+def get_image_paths():
+    image_dir = input("Enter the folder containing the images to benchmark: ")
+    num_images = int(input("Enter the number of images to use: "))
+    return sorted(f"{image_dir}/{image}" for image in os.listdir(
+        image_dir) if image.endswith(".png"))[:num_images]
+
+
+if __name__ == "__main__":
+    benchmark = input(
+        "Enter the benchmark to run (batch/postprocessing/onnx/windowed/startup): ")
+    if benchmark == "startup":
+        if not benchmark_startup(input("Enter the path of an image to predict: ")):
+            sys.exit(1)
+    elif benchmark == "windowed":
+        benchmark_windowed([100, 200, 400, 800, 1600])
+    elif benchmark == "onnx":
+        image_paths = get_image_paths()
+        batch_size = int(input("Enter the batch size: "))
+        num_threads = input("Enter the number of intra-op threads (default all): ")
+        benchmark_model_backends(image_paths, batch_size,
+                                 int(num_threads) if num_threads else None)
+    elif benchmark == "postprocessing":
+        legacy_throughput, throughput = benchmark_postprocessing(
+            ImageAnnotator(ocr_cache_dir=None))
+        print(f"legacy post-processing: {legacy_throughput:.2f} pages/sec")
+        print(f"NumPy post-processing: {throughput:.2f} pages/sec")
+    else:
+        image_paths = get_image_paths()
+        batch_sizes = [int(size) for size in input(
+            "Enter the batch sizes to compare (e.g. 4,8,16): ").split(",")]
+        # the same images go through every mode, cached results and OCR would skip the work being measured
+        annotator = ImageAnnotator(result_cache=False, ocr_cache_dir=None)
+        # Warm up the model so the first measured call does not pay for lazy initialisation
+        annotator.run_batch(image_paths[:1], batch_size=1)
+
+        print(f"run loop: {benchmark_run(annotator, image_paths):.2f} images/sec")
+        for batch_size in batch_sizes:
+            throughput = benchmark_run_batch(
+                annotator, image_paths, batch_size)
+            print(
+                f"run_batch (batch_size={batch_size}): {throughput:.2f} images/sec")
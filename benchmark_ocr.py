@@ -0,0 +1,43 @@
+import os
+import time
+from PIL import Image
+from ocr_backends import BACKENDS, get_backend
+
+
+def benchmark_backend(backend, images, regions_per_image=10):
+    """Time full-page OCR and region OCR with a backend, returning both throughputs."""
+    start = time.perf_counter()
+    backend.images_to_data(images)
+    pages_per_sec = len(images) / (time.perf_counter() - start)
+
+    # Small crops of the pages, like the regions OCR'd by ImageAnnotator.annotate_image
+    rois = []
+    for image in images:
+        width, height = image.size
+        step = height // regions_per_image
+        rois.extend(image.crop((0, i * step, width // 2, i * step + step // 2))
+                    for i in range(regions_per_image))
+    start = time.perf_counter()
+    backend.images_to_string(rois)
+    regions_per_sec = len(rois) / (time.perf_counter() - start)
+    return pages_per_sec, regions_per_sec
+
+
+if __name__ == "__main__":
+    image_dir = input("Enter the folder containing the images to benchmark: ")
+    num_images = int(input("Enter the number of images to use: "))
+    image_paths = sorted(f"{image_dir}/{image}" for image in os.listdir(
+        image_dir) if image.endswith(".png"))[:num_images]
+    images = [Image.open(image_path).convert('L')
+              for image_path in image_paths]
+
+    for name in BACKENDS:
+        try:
+            backend = get_backend(name)
+        except ImportError as e:
+            print(f"{name}: skipped ({e})")
+            continue
+        pages_per_sec, regions_per_sec = benchmark_backend(backend, images)
+        backend.close()
+        print(f"{name}: {pages_per_sec:.2f} pages/sec, "
+              f"{regions_per_sec:.2f} regions/sec")
@@ -0,0 +1,159 @@
+import hashlib
+import json
+import os
+from collections import OrderedDict
+
+
+def file_digest(path, chunk_size=1 << 20):
+    """SHA-256 of the content of a file, read in chunks."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while chunk := f.read(chunk_size):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class DiskCache:
+    """JSON values stored one file per key, evicting the least recently used files above max_bytes.
+
+    Several processes can share the same folder: writes go through a temporary file and
+    a missing file is treated as a miss.
+    """
+
+    def __init__(self, cache_dir, max_bytes=1 << 30):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(cache_dir, exist_ok=True)
+        self.size = sum(entry.stat().st_size for entry in self.entries())
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, key[:2], f'{key}.json')
+
+    def entries(self):
+        for folder in os.scandir(self.cache_dir):
+            if folder.is_dir():
+                yield from (entry for entry in os.scandir(folder.path) if entry.name.endswith('.json'))
+
+    def get(self, key):
+        """Return the cached value, or None if the key is not in the cache."""
+        path = self.path(key)
+        try:
+            with open(path) as f:
+                value = json.load(f)
+            # the modification time is the recency used for the LRU eviction
+            os.utime(path)
+        except (FileNotFoundError, ValueError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(value, f)
+        try:
+            # the value of the key is replaced, not added
+            self.size -= os.path.getsize(path)
+        except FileNotFoundError:
+            pass
+        os.replace(tmp_path, path)
+        self.size += os.path.getsize(path)
+        if self.size > self.max_bytes:
+            self.evict()
+
+    def evict(self):
+        """Remove the least recently used entries until the cache is back under 90% of max_bytes."""
+        entries = []
+        for entry in self.entries():
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+        entries.sort()
+        self.size = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if self.size <= 0.9 * self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self.size -= size
+            self.evictions += 1
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions, 'size': self.size}
+
+
+class MemoryCache:
+    """JSON values kept in memory, evicting the least recently used above max_bytes.
+
+    Values are stored serialized so that callers can't modify a cached value in place.
+    """
+
+    def __init__(self, max_bytes=64 << 20):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.size = 0
+
+    def get(self, key):
+        data = self.entries.get(key)
+        if data is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return json.loads(data)
+
+    def put(self, key, value):
+        data = json.dumps(value)
+        if key in self.entries:
+            self.size -= len(self.entries.pop(key))
+        self.entries[key] = data
+        self.size += len(data)
+        while self.size > self.max_bytes and self.entries:
+            _, data = self.entries.popitem(last=False)
+            self.size -= len(data)
+            self.evictions += 1
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions, 'size': self.size}
+
+
+class TieredCache:
+    """A MemoryCache in front of a DiskCache, disk hits are promoted to memory."""
+
+    def __init__(self, memory, disk=None):
+        self.memory = memory
+        self.disk = disk
+
+    def get(self, key):
+        value = self.memory.get(key)
+        if value is None and self.disk is not None:
+            value = self.disk.get(key)
+            if value is not None:
+                self.memory.put(key, value)
+        return value
+
+    def put(self, key, value):
+        self.memory.put(key, value)
+        if self.disk is not None:
+            self.disk.put(key, value)
+
+    def stats(self):
+        stats = {'memory': self.memory.stats()}
+        if self.disk is not None:
+            stats['disk'] = self.disk.stats()
+        return stats
@@ -0,0 +1,89 @@
+import json
+import os
+import time
+import numpy as np
+from Inference import ImageAnnotator, load_image
+from format_output import transform_format
+
+
+def load_done_pages(done_dir, label2id):
+    """Yield the name, the image, the annotated words with their pixel boxes and the gold label ids of every done page."""
+    for file in sorted(os.listdir(done_dir)):
+        if not file.endswith(".json"):
+            continue
+        with open(os.path.join(done_dir, file)) as f:
+            data = transform_format(json.load(f), label2id)
+        image = load_image(data["image_path"])
+        height, width = image.shape[:2]
+        # the annotated boxes are [x1, y1, x2, y2] in percent of the image size
+        boxes = [[box[0] * width / 100, box[1] * height / 100, box[2] * width / 100, box[3] * height / 100]
+                 for box in data["bboxes"]]
+        yield file, image, (data["tokens"], boxes), np.array(data["ner_tags"])
+
+
+def predict_words(annotator, image, page_words):
+    """Return the ids of the words kept by the processor, their predicted label ids and the forward time."""
+    encoding = annotator.encode([image], [page_words])
+    start = time.perf_counter()
+    logits = annotator.model(encoding)
+    elapsed = time.perf_counter() - start
+    # the prediction of a word is the one of its first token
+    predictions = {}
+    for token_idx, word_id in enumerate(encoding.word_ids(0)):
+        if word_id is not None and word_id not in predictions:
+            predictions[word_id] = int(logits[0, token_idx].argmax())
+    word_ids = np.array(sorted(predictions), dtype=int)
+    return word_ids, np.array([predictions[word_id] for word_id in word_ids], dtype=int), elapsed
+
+
+def token_f1(predictions, gold, o_id):
+    """Micro F1 over the words that are not "O", either in the predictions or in the gold labels."""
+    true_positives = np.sum((predictions == gold) & (gold != o_id))
+    predicted = np.sum(predictions != o_id)
+    actual = np.sum(gold != o_id)
+    precision = true_positives / predicted if predicted else 0
+    recall = true_positives / actual if actual else 0
+    return 2 * precision * recall / (precision + recall) if precision + recall else 0
+
+
+def compare_models(done_dir="done", labels_path="labels.json", model_path="model", quantized_path="model_quantized"):
+    annotators = {
+        "fp32": ImageAnnotator(model_path=model_path, labels_path=labels_path, single_ocr_pass=True),
+        "int8": ImageAnnotator(model_path=model_path, labels_path=labels_path, single_ocr_pass=True,
+                               model_backend="quantized", quantized_path=quantized_path),
+    }
+    label2id = annotators["fp32"].label2id
+    predictions = {name: [] for name in annotators}
+    times = {name: 0.0 for name in annotators}
+    gold = []
+    for file, image, page_words, ner_tags in load_done_pages(done_dir, label2id):
+        for name, annotator in annotators.items():
+            word_ids, page_predictions, elapsed = predict_words(
+                annotator, image, page_words)
+            predictions[name].append(page_predictions)
+            times[name] += elapsed
+        gold.append(ner_tags[word_ids])
+    predictions = {name: np.concatenate(
+        page_predictions) for name, page_predictions in predictions.items()}
+    gold = np.concatenate(gold)
+
+    print("Per-label agreement of int8 with fp32:")
+    for label, label_id in label2id.items():
+        is_label = predictions["fp32"] == label_id
+        if is_label.any():
+            agreement = np.mean(predictions["int8"][is_label] == label_id)
+            print(f"  {label}: {agreement * 100:.2f}% of {is_label.sum()} words")
+    print(
+        f"Overall agreement: {np.mean(predictions['fp32'] == predictions['int8']) * 100:.2f}%")
+
+    o_id = label2id.get("O", -1)
+    f1 = {name: token_f1(predictions[name], gold, o_id) for name in annotators}
+    print(f"Token-level F1: fp32 {f1['fp32']:.4f}, int8 {f1['int8']:.4f}, "
+          f"delta {f1['int8'] - f1['fp32']:+.4f}")
+    print(f"Forward time: fp32 {times['fp32']:.2f}s, int8 {times['int8']:.2f}s, "
+          f"speedup x{times['fp32'] / times['int8']:.2f}")
+
+
+if __name__ == "__main__":
+    done_dir = input("Enter the folder of annotated files (default done): ")
+    compare_models(done_dir or "done")
@@ -1,10 +1,51 @@
-from pdf2image import convert_from_path
+from pdf2image import convert_from_path, pdfinfo_from_path
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack
+from itertools import repeat
 from pathlib import Path
 import shutil
+import time
 from tqdm import tqdm
 
 
-def convert_to_images(to_convert_folder, output_folder):
+def page_image_name(stem, page_index, page_count, fmt='png'):
+    """Single page PDFs keep their name, the pages of longer ones are numbered from 0."""
+    if page_count == 1:
+        return f'{stem}.{fmt}'
+    return f'{stem}_{page_index}.{fmt}'
+
+
+def rasterize_pages(pdf_file, dpi=200, chunk_size=8):
+    """
+    Yield (page_index, page_count, image) for every page of a PDF.
+    Only chunk_size pages are rasterized at a time, so long PDFs don't have to fit in memory.
+    """
+    page_count = pdfinfo_from_path(pdf_file)['Pages']
+    for first_page in range(1, page_count + 1, chunk_size):
+        last_page = min(first_page + chunk_size - 1, page_count)
+        images = convert_from_path(
+            pdf_file, dpi=dpi, first_page=first_page, last_page=last_page)
+        for i, image in enumerate(images):
+            yield first_page - 1 + i, page_count, image
+
+
+def convert_pdf(pdf_file, image_folder, dpi=200, fmt='png', chunk_size=8):
+    """Save every page of a PDF as soon as it is rasterized, return the number of pages."""
+    page_count = 0
+    for page_index, page_count, image in rasterize_pages(pdf_file, dpi, chunk_size):
+        image.save(Path(image_folder) / page_image_name(Path(pdf_file).stem, page_index, page_count, fmt))
+    return page_count
+
+
+def convert_to_images(to_convert_folder, output_folder, dpi=200, fmt='png', workers=1, chunk_size=8):
+    """
+    Convert the PDFs of to_convert_folder to one image per page in output_folder.
+    :param dpi: resolution of the rasterization
+    :param fmt: extension of the images, png or jpg
+    :param workers: number of PDFs rasterized in parallel
+    :param chunk_size: number of pages of a PDF held in memory at once
+    :return: the number of pages converted
+    """
 
     # Path to the folder containing PDFs to convert
     pdf_folder = Path(to_convert_folder)
@@ -15,18 +56,21 @@ def convert_to_images(to_convert_folder, output_folder):
 
     # Convert each PDF file into images and save them
     pdf_files = list(pdf_folder.glob('*.pdf'))
-    for pdf_file in tqdm(pdf_files, desc="Converting PDFs to images"):
-        images = convert_from_path(pdf_file)
-
-        if len(images) == 1:
-            image = images[0]
-            image_path = image_folder / f'{pdf_file.stem}.png'
-            image.save(image_path, 'PNG')
-        # Save each image with a unique name
+    start = time.perf_counter()
+    page_count = 0
+    with ExitStack() as stack:
+        arguments = (pdf_files, repeat(image_folder), repeat(dpi), repeat(fmt), repeat(chunk_size))
+        if workers > 1:
+            executor = stack.enter_context(
+                ProcessPoolExecutor(max_workers=workers))
+            page_counts = executor.map(convert_pdf, *arguments)
         else:
-            for i, image in enumerate(images):
-                image_path = image_folder / f'{pdf_file.stem}_{i}.png'
-                image.save(image_path, 'PNG')
+            page_counts = map(convert_pdf, *arguments)
+        for pdf_page_count in tqdm(page_counts, total=len(pdf_files), desc="Converting PDFs to images"):
+            page_count += pdf_page_count
+    elapsed = time.perf_counter() - start
+    if page_count:
+        print(f"{page_count} pages in {elapsed:.1f}s: {page_count / elapsed:.2f} pages/sec")
 
     # Move all image files from 'to_convert' to 'images'
     # List of image extensions to look for
@@ -34,10 +78,13 @@ def convert_to_images(to_convert_folder, output_folder):
     for extension in image_extensions:
         for img_file in pdf_folder.glob(extension):
             shutil.move(str(img_file), str(image_folder / img_file.name))
+    return page_count
 
 
 if __name__ == "__main__":
     input_folder = input("Enter the folder name containing PDFs to convert: ")
     output_folder = input(
         "Enter the folder name to save the converted images: ")
-    convert_to_images(input_folder, output_folder)
+    workers = input("Enter the number of PDFs to convert in parallel (default 1): ")
+    convert_to_images(input_folder, output_folder,
+                      workers=int(workers) if workers else 1)
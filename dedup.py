@@ -0,0 +1,210 @@
+import json
+import os
+import threading
+import numpy as np
+from PIL import Image
+from ocr import IMAGE_EXTENSIONS, get_output_file
+from ocr_backends import image_digest
+
+# Content digests and perceptual hashes of the ingested pages, and the duplicates found among them
+DEDUP_PATH = 'dedup.json'
+
+
+def dhash(image, hash_size=16, min_gradient=2):
+    """
+    Difference hash of a page: which horizontal gradients of a hash_size x hash_size thumbnail are positive.
+    Re-scans and re-exports of a page differ by a few bits, but so do two documents filled on the same
+    template, the hash only finds candidates.
+    The gradients between blank cells are noise, they must exceed min_gradient grey levels to count.
+    :return: the hash_size ** 2 bits as an int
+    """
+    small = image.convert('L').resize((hash_size + 1, hash_size), Image.Resampling.BOX, reducing_gap=2.0)
+    pixels = np.asarray(small, dtype=np.int16)
+    bits = np.packbits(pixels[:, 1:] - pixels[:, :-1] > min_gradient)
+    return int.from_bytes(bits.tobytes(), 'big')
+
+
+class HashIndex:
+    """
+    Finds the hashes within max_distance bits of a query without comparing it to every hash.
+    The bits are split in max_distance + 1 bands: two hashes that close agree on at least one band,
+    so only the hashes sharing a band with the query are compared.
+    """
+
+    def __init__(self, max_distance=8, num_bits=256):
+        self.max_distance = max_distance
+        self.bands = [(int(band[0]), len(band))
+                      for band in np.array_split(np.arange(num_bits), max_distance + 1)]
+        self.tables = [{} for _ in self.bands]
+        self.hashes = {}
+
+    def band_values(self, value):
+        return [(value >> start) & ((1 << width) - 1) for start, width in self.bands]
+
+    def add(self, key, value):
+        self.hashes[key] = value
+        for table, band in zip(self.tables, self.band_values(value)):
+            table.setdefault(band, []).append(key)
+
+    def find(self, value):
+        """Return the (key, distance) of the closest hash within max_distance bits, or None."""
+        candidates = {key for table, band in zip(self.tables, self.band_values(value))
+                      for key in table.get(band, ())}
+        best = min(((key, (self.hashes[key] ^ value).bit_count()) for key in candidates),
+                   key=lambda match: match[1], default=None)
+        if best is not None and best[1] <= self.max_distance:
+            return best
+        return None
+
+
+class DedupIndex:
+    """
+    Content digests and perceptual hashes of the pages of the image folder, saved in a JSON file with the
+    duplicates found so far. The first page seen is the canonical one.
+    Only the exact duplicates, with the same pixels, skip the OCR and reuse the work of their canonical page.
+    The near-duplicates are candidates: they are processed like any other page, and get the labels of their
+    canonical page only when their words are the same, see reuse_canonical_work.
+    """
+
+    def __init__(self, path=DEDUP_PATH, max_distance=8):
+        self.path = path
+        self.index = HashIndex(max_distance)
+        # image name of every content digest
+        self.digests = {}
+        # canonical page of the exact duplicates and of the near-duplicate candidates
+        self.duplicates = {}
+        self.candidates = {}
+        self.lock = threading.Lock()
+        # (source, image name, canonical image name, exact) of the duplicates found by this run
+        self.found = []
+        if os.path.exists(path):
+            with open(path) as f:
+                data = json.load(f)
+            for name, value in data['hashes'].items():
+                self.index.add(name, int(value, 16))
+            # the duplicates of the files written before the digests were never confirmed, they are dropped
+            if 'digests' in data:
+                self.digests = data['digests']
+                self.duplicates = data['duplicates']
+                self.candidates = data['candidates']
+
+    def add_folder(self, image_folder):
+        """Hash the images of the folder that are not in the index yet, e.g. the corpus before dedup existed."""
+        known = set(self.digests.values())
+        for name in sorted(os.listdir(image_folder)):
+            if name.lower().endswith(IMAGE_EXTENSIONS) and name not in known and name not in self.duplicates:
+                with Image.open(os.path.join(image_folder, name)) as image:
+                    self.index.add(name, dhash(image))
+                    self.digests.setdefault(image_digest(image), name)
+
+    def check(self, name, image, source=None):
+        """
+        Return the canonical page of an exact duplicate, or add the page to the index and return None.
+        A near-duplicate is added too, and listed in found as a candidate.
+        """
+        digest = image_digest(image)
+        value = dhash(image)
+        with self.lock:
+            canonical = self.digests.get(digest)
+            if canonical == name:
+                # added by an earlier attempt at the same source, which failed
+                if name in self.candidates:
+                    self.found.append((source, name, self.candidates[name], False))
+                return None
+            if canonical is not None:
+                self.duplicates[name] = canonical
+                self.found.append((source, name, canonical, True))
+                return canonical
+            match = self.index.find(value)
+            self.index.add(name, value)
+            self.digests[digest] = name
+            if match is not None:
+                self.candidates[name] = match[0]
+                self.found.append((source, name, match[0], False))
+            return None
+
+    def save(self):
+        with open(f'{self.path}.tmp', mode='w') as f:
+            json.dump({'hashes': {name: f'{value:x}' for name, value in self.index.hashes.items()},
+                       'digests': self.digests, 'duplicates': self.duplicates,
+                       'candidates': self.candidates}, f, indent=2)
+        os.replace(f'{self.path}.tmp', self.path)
+
+
+def load_duplicates(path=DEDUP_PATH):
+    """Return the canonical page of every exact duplicate found so far."""
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        data = json.load(f)
+    return data['duplicates'] if 'digests' in data else {}
+
+
+def write_task(task, task_file):
+    with open(f'{task_file}.tmp', mode='w') as f:
+        json.dump(task, f, indent=2)
+    os.replace(f'{task_file}.tmp', task_file)
+
+
+def copy_task(canonical_file, duplicate_file, image_path):
+    with open(canonical_file) as f:
+        task = json.load(f)
+    task['data']['ocr'] = image_path
+    write_task(task, duplicate_file)
+
+
+def transcriptions(task):
+    return [result['value'] for result in task['predictions'][0]['result']
+            if result['from_name'] == 'transcription']
+
+
+def copy_labels(canonical_file, candidate_file):
+    """
+    Give a near-duplicate the labels of its canonical page if the OCR found the same words on both,
+    the boxes of the near-duplicate are kept.
+    :return: whether the words matched
+    """
+    with open(canonical_file) as f:
+        canonical_values = transcriptions(json.load(f))
+    with open(candidate_file) as f:
+        task = json.load(f)
+    values = transcriptions(task)
+    if not values or [value['text'] for value in values] != [value['text'] for value in canonical_values]:
+        return False
+    for value, canonical_value in zip(values, canonical_values):
+        value['label'] = canonical_value['label']
+    write_task(task, candidate_file)
+    return True
+
+
+def reuse_canonical_work(found, image_folder='images', todo_dir='todo', done_dir='done'):
+    """
+    Pre-fill the tasks of the duplicates in todo_dir, they are still reviewed in the annotation tool.
+    An exact duplicate gets the task of its canonical page, the annotated one from done_dir when there is one.
+    A near-duplicate candidate keeps its own OCR, and gets the labels of its annotated canonical page only
+    if their words are the same. Nothing is ever written to done_dir.
+    The predictions of the exact duplicates are reused by batch_runner.BatchRunner.
+    :param found: (source, image name, canonical image name, exact) of the duplicates
+    :return: the counts of duplicates, candidates and confirmed candidates, and the (source, image path)
+        of the exact duplicates whose canonical page has no task, e.g. because its OCR failed
+    """
+    report = {'duplicates': 0, 'candidates': 0, 'confirmed': 0}
+    missing = []
+    for source, name, canonical, exact in found:
+        image_path = f'{image_folder}/{name}'
+        if not exact:
+            report['candidates'] += 1
+            # the candidate was OCR'd like any page, unless it failed
+            if os.path.exists(get_output_file(canonical, done_dir)) and \
+                    os.path.exists(get_output_file(name, todo_dir)) and \
+                    copy_labels(get_output_file(canonical, done_dir), get_output_file(name, todo_dir)):
+                report['confirmed'] += 1
+            continue
+        report['duplicates'] += 1
+        for canonical_dir in [done_dir, todo_dir]:
+            if os.path.exists(get_output_file(canonical, canonical_dir)):
+                copy_task(get_output_file(canonical, canonical_dir), get_output_file(name, todo_dir), image_path)
+                break
+        else:
+            missing.append((source, image_path))
+    return report, missing
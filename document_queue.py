@@ -0,0 +1,86 @@
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+from image_pyramid import ImagePyramid
+
+
+def load_document(path, tiled=False, view=None):
+    """
+    Do the slow part of opening an annotations file: parse the JSON and decode the image, or build its
+    pyramid and decode the tiles of the first view.
+    :param view: (scale, width, height) of the canvas the document is going to be shown in
+    :return: dict with the path, mtime, data, image and pyramid of the document
+    """
+    mtime = os.path.getmtime(path)
+    with open(path) as f:
+        data = json.load(f)
+    # the file is closed once loaded, or right away in tiled mode where only the size of the image is used
+    with Image.open(data['data']['ocr']) as image:
+        if not tiled:
+            image.load()
+    pyramid = None
+    if tiled:
+        pyramid = ImagePyramid(data['data']['ocr'])
+        pyramid.build()
+        if view is not None:
+            scale, width, height = view
+            level = pyramid.level_for(scale)
+            for col, row in pyramid.tiles_in(level, 0, 0, width / scale / 2 ** level, height / scale / 2 ** level):
+                pyramid.tile(level, col, row)
+    return {'path': path, 'mtime': mtime, 'data': data, 'image': image, 'pyramid': pyramid}
+
+
+class DocumentQueue:
+    """
+    The annotations files of a folder in name order. The next prefetch files are loaded by load_document
+    on a background thread while the current one is being annotated. Once every file was given, the files
+    still in the folder, skipped without being moved to done, are given again from the first one.
+    """
+
+    def __init__(self, todo_dir, prefetch=2, tiled=False):
+        self.todo_dir = todo_dir
+        self.prefetch = prefetch
+        self.tiled = tiled
+        # (scale, width, height) of the canvas, see load_document
+        self.view = None
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        # futures of the documents being prefetched, by path
+        self.loading = {}
+        # files given in this round
+        self.given = set()
+
+    def upcoming(self):
+        """Return the paths of the files not given yet, in order, the files moved away meanwhile are left out."""
+        return [path for path in (os.path.join(self.todo_dir, name)
+                                  for name in sorted(os.listdir(self.todo_dir)) if name.endswith('.json'))
+                if path not in self.given]
+
+    def next(self):
+        """Return the next document, or None when the folder is empty."""
+        paths = self.upcoming()[:self.prefetch + 1]
+        if not paths and self.given:
+            self.given.clear()
+            paths = self.upcoming()[:self.prefetch + 1]
+        if not paths:
+            return None
+        path = paths[0]
+        self.given.add(path)
+        future = self.loading.pop(path, None)
+        for stale_path in [stale_path for stale_path in self.loading if stale_path not in paths]:
+            self.loading.pop(stale_path).cancel()
+        # the following documents load while the current one is finished or shown
+        for next_path in paths[1:]:
+            if next_path not in self.loading:
+                self.loading[next_path] = self.executor.submit(load_document, next_path, self.tiled, self.view)
+        document = None
+        if future is not None:
+            try:
+                document = future.result()
+            except Exception:
+                # loaded again below, to report the error
+                pass
+        # the file may have changed since it was prefetched
+        if document is None or document['mtime'] != os.path.getmtime(path):
+            document = load_document(path, self.tiled, self.view)
+        return document
@@ -0,0 +1,41 @@
+import json
+import torch
+from transformers import AutoModelForTokenClassification
+from model_backends import MODEL_INPUTS, require
+
+
+def export_to_onnx(model_path, labels_path, onnx_path, max_length=256, opset_version=17):
+    """Export the fine-tuned token classifier to ONNX, with dynamic batch and sequence axes."""
+    # torch.onnx.export writes the graph through the onnx package
+    require('onnx', "Exporting to ONNX")
+    with open(labels_path) as f:
+        label2id = json.load(f)
+    model = AutoModelForTokenClassification.from_pretrained(
+        model_path, num_labels=len(label2id))
+    model.eval()
+
+    dummy_inputs = {
+        'input_ids': torch.ones((1, max_length), dtype=torch.long),
+        'bbox': torch.zeros((1, max_length, 4), dtype=torch.long),
+        'attention_mask': torch.ones((1, max_length), dtype=torch.long),
+        'pixel_values': torch.zeros((1, 3, 224, 224), dtype=torch.float32),
+    }
+    dynamic_axes = {
+        'input_ids': {0: 'batch', 1: 'sequence'},
+        'attention_mask': {0: 'batch', 1: 'sequence'},
+        'bbox': {0: 'batch', 1: 'sequence'},
+        'pixel_values': {0: 'batch'},
+        'logits': {0: 'batch', 1: 'sequence'},
+    }
+    with torch.no_grad():
+        # a trailing dict in args is passed to forward as keyword arguments
+        torch.onnx.export(model, (dummy_inputs,), onnx_path, input_names=MODEL_INPUTS,
+                          output_names=['logits'], dynamic_axes=dynamic_axes,
+                          opset_version=opset_version)
+
+
+if __name__ == "__main__":
+    model_path = input("Enter the path of the model to export (default model): ")
+    onnx_path = input("Enter the path of the ONNX file (default model.onnx): ")
+    export_to_onnx(model_path or "model", "labels.json",
+                   onnx_path or "model.onnx")
@@ -1,25 +1,36 @@
-import json
-import os
-from Inference import ImageAnnotator
-from tqdm import tqdm
+import argparse
 
-annotator = ImageAnnotator()
-if not os.path.exists("results"):
-    os.mkdir("results")
 
-errors = []
-images = os.listdir("images")
-for image in tqdm(images, desc="Annotating images"):
-    if image.endswith(".png"):
-        if os.path.exists(f"results/{image.replace('.png', '.json')}"):
-            continue
-        try:
-            result_dict = annotator.run(f"images/{image}")
-            with open(f"results/{image.replace(".png", ".json")}", mode='w') as f:
-                json.dump(result_dict, f, indent=2)
-        except Exception as e:
-            errors.append(f"Error processing {image}: {e}")
-            continue
-for error in errors:
-    print(error)
-print(f"Total errors rate: {len(errors)/len(images)*100:.2f}%")
+def main():
+    parser = argparse.ArgumentParser(
+        description="Annotate the images with the model and save the results as JSON.")
+    parser.add_argument("--images", default="images")
+    parser.add_argument("--results", default="results")
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--workers", type=int, default=1,
+                        help="number of processes, each one loads its own model")
+    args = parser.parse_args()
+
+    # Importing the model stack takes seconds, the annotator only loads the model for the first prediction
+    from batch_runner import BatchRunner
+    from dedup import load_duplicates
+    runner = BatchRunner(args.images, args.results, workers=args.workers,
+                         batch_size=args.batch_size, duplicates=load_duplicates())
+    pending = runner.pending()
+    if not pending:
+        print("No new images to annotate")
+        return
+
+    errors = runner.run(pending)
+    for image, error in errors:
+        print(f"Error processing {image}: {error}")
+    print(f"Total errors rate: {len(errors)/len(pending)*100:.2f}%")
+    if runner.reused:
+        print(f"Reused the predictions of {runner.reused} duplicate pages")
+    print(f"Manifest: {runner.manifest_path}")
+    if hasattr(runner.annotator.ocr_backend, "cache"):
+        print(f"OCR cache: {runner.annotator.ocr_backend.cache.stats()}")
+
+
+if __name__ == "__main__":
+    main()
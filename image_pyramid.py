@@ -0,0 +1,125 @@
+import json
+import math
+import os
+import shutil
+import tempfile
+from collections import OrderedDict
+from PIL import Image
+
+TILE_SIZE = 512
+
+
+def pyramid_dir(image_path):
+    """The tiles of an image are cached next to it, in <image>.tiles/"""
+    return f'{image_path}.tiles'
+
+
+class ImagePyramid:
+    """
+    An image and its copies downsampled by 2, 4, 8... cut in tiles of tile_size pixels.
+    The tiles are built once and saved next to the image, a page is then displayed at any zoom by
+    decoding the few tiles in view instead of the whole scan.
+    Level 0 is the full resolution, level k is 2 ** k times smaller, the last level fits in one tile.
+    """
+
+    def __init__(self, image_path, tile_size=TILE_SIZE, max_tiles=256):
+        self.image_path = image_path
+        self.tile_size = tile_size
+        self.directory = pyramid_dir(image_path)
+        with Image.open(image_path) as image:
+            self.size = image.size
+        self.levels = max(1, math.ceil(math.log2(max(self.size) / tile_size)) + 1)
+        self.max_tiles = max_tiles
+        # decoded tiles, least recently used first
+        self.tiles = OrderedDict()
+
+    def level_size(self, level):
+        return tuple(math.ceil(side / 2 ** level) for side in self.size)
+
+    def stamp(self):
+        """What the tiles were built from, they are rebuilt when it changes."""
+        stat = os.stat(self.image_path)
+        return {'size': stat.st_size, 'mtime': stat.st_mtime, 'tile_size': self.tile_size}
+
+    def is_built(self):
+        try:
+            with open(os.path.join(self.directory, 'pyramid.json')) as f:
+                return json.load(f) == self.stamp()
+        except (OSError, ValueError):
+            return False
+
+    def build(self):
+        """Cut every level in tiles, unless the tiles of this version of the image are on disk already."""
+        if self.is_built():
+            return
+        # every build has its own directory, the UI and the prefetch thread can build the same image at once
+        tmp_dir = tempfile.mkdtemp(prefix=f'.{os.path.basename(self.directory)}.',
+                                   dir=os.path.dirname(self.directory) or '.')
+        try:
+            self.cut_tiles(tmp_dir)
+        except BaseException:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+        if self.is_built():
+            # built meanwhile by another thread, its tiles may be in use
+            shutil.rmtree(tmp_dir)
+        else:
+            # the tiles of an older version of the image are replaced at once
+            shutil.rmtree(self.directory, ignore_errors=True)
+            try:
+                os.replace(tmp_dir, self.directory)
+            except OSError:
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+                if not self.is_built():
+                    raise
+        self.tiles.clear()
+
+    def cut_tiles(self, directory):
+        with Image.open(self.image_path) as image:
+            level_image = image.convert('RGB')
+        for level in range(self.levels):
+            if level:
+                level_image = level_image.reduce(2)
+            for col, row in self.tiles_in(level, 0, 0, *self.level_size(level)):
+                tile = level_image.crop((col * self.tile_size, row * self.tile_size,
+                                         (col + 1) * self.tile_size, (row + 1) * self.tile_size))
+                # the tiles of the right and bottom edges are smaller
+                tile = tile.crop((0, 0, min(self.tile_size, level_image.width - col * self.tile_size),
+                                  min(self.tile_size, level_image.height - row * self.tile_size)))
+                tile.save(os.path.join(directory, f'{level}_{col}_{row}.png'), compress_level=1)
+        with open(os.path.join(directory, 'pyramid.json'), 'w') as f:
+            json.dump(self.stamp(), f)
+
+    def level_for(self, scale):
+        """Return the smallest level with at least the resolution of the zoom."""
+        if scale >= 1:
+            return 0
+        return min(self.levels - 1, int(math.log2(1 / scale)))
+
+    def tiles_in(self, level, x1, y1, x2, y2):
+        """Return the (col, row) of the tiles of the level intersecting the rectangle, in level pixels."""
+        width, height = self.level_size(level)
+        cols = range(max(0, int(x1 // self.tile_size)),
+                     min(math.ceil(width / self.tile_size), int(x2 // self.tile_size) + 1))
+        rows = range(max(0, int(y1 // self.tile_size)),
+                     min(math.ceil(height / self.tile_size), int(y2 // self.tile_size) + 1))
+        return [(col, row) for row in rows for col in cols]
+
+    def tile_box(self, level, col, row):
+        """Return the box of a tile in full resolution pixels."""
+        factor = 2 ** level
+        step = self.tile_size * factor
+        return (col * step, row * step,
+                min((col + 1) * step, self.size[0]), min((row + 1) * step, self.size[1]))
+
+    def tile(self, level, col, row):
+        key = (level, col, row)
+        if key in self.tiles:
+            self.tiles.move_to_end(key)
+            return self.tiles[key]
+        with Image.open(os.path.join(self.directory, f'{level}_{col}_{row}.png')) as tile:
+            tile.load()
+        self.tiles[key] = tile
+        if len(self.tiles) > self.max_tiles:
+            self.tiles.popitem(last=False)
+        return tile
@@ -0,0 +1,176 @@
+import argparse
+import io
+import json
+import os
+import queue
+import socketserver
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+from PIL import Image
+from Inference import ImageAnnotator
+
+
+class MicroBatcher:
+    """Collects concurrent requests into micro-batches for a single warm ImageAnnotator.
+
+    A batch is sent to the model as soon as it holds max_batch_size images, or max_wait seconds
+    after its first image arrived.
+    """
+
+    def __init__(self, annotator, max_batch_size=8, max_wait=0.01, history=10000):
+        self.annotator = annotator
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.latencies = deque(maxlen=history)
+        self.batch_sizes = deque(maxlen=history)
+        self.requests = 0
+        self.errors = 0
+        self.thread = threading.Thread(target=self.loop, daemon=True)
+        self.thread.start()
+
+    def submit(self, image):
+        """Queue an image (path, PIL image or RGB array) and return a Future of its result dictionary."""
+        future = Future()
+        self.queue.put((image, future, time.perf_counter()))
+        return future
+
+    def next_batch(self):
+        batch = [self.queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def loop(self):
+        while True:
+            batch = self.next_batch()
+            try:
+                results, errors = self.annotator.run_batch(
+                    [image for image, _, _ in batch], batch_size=len(batch))
+            except Exception as e:
+                results, errors = [None] * len(batch), [e] * len(batch)
+            done = time.perf_counter()
+            with self.lock:
+                self.batch_sizes.append(len(batch))
+                for (_, _, submitted), error in zip(batch, errors):
+                    self.latencies.append(done - submitted)
+                    self.requests += 1
+                    self.errors += error is not None
+            for (_, future, _), result, error in zip(batch, results, errors):
+                if error is not None:
+                    future.set_exception(error)
+                else:
+                    future.set_result(result)
+
+    def metrics(self):
+        with self.lock:
+            latencies = np.array(self.latencies) * 1000
+            batch_sizes = np.array(self.batch_sizes)
+            requests, errors = self.requests, self.errors
+        return {
+            'queue_depth': self.queue.qsize(),
+            'requests': requests,
+            'errors': errors,
+            'mean_batch_size': float(batch_sizes.mean()) if len(batch_sizes) else 0,
+            'latency_ms': {f'p{q}': float(np.percentile(latencies, q)) if len(latencies) else 0
+                           for q in (50, 90, 99)},
+        }
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    """POST /predict with an image body or {"path": ...}, GET /metrics and GET /health."""
+
+    batcher = None
+
+    def address_string(self):
+        # unix socket clients have no address
+        return self.client_address[0] if self.client_address else 'unix'
+
+    def send_json(self, status, data):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == '/metrics':
+            self.send_json(200, self.batcher.metrics())
+        elif self.path == '/health':
+            self.send_json(200, {'status': 'ok'})
+        else:
+            self.send_json(404, {'error': f'Unknown path {self.path}'})
+
+    def do_POST(self):
+        if self.path != '/predict':
+            self.send_json(404, {'error': f'Unknown path {self.path}'})
+            return
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        try:
+            if self.headers.get('Content-Type', '').startswith('image/'):
+                image = Image.open(io.BytesIO(body))
+            else:
+                image = json.loads(body)['path']
+            result = self.batcher.submit(image).result()
+        except Exception as e:
+            self.send_json(400, {'error': f'{type(e).__name__}: {e}'})
+            return
+        self.send_json(200, result)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def serve(annotator, host='127.0.0.1', port=8000, socket_path=None, max_batch_size=8, max_wait=0.01):
+    # every server gets its own handler class bound to its batcher
+    handler = type('BatcherRequestHandler', (RequestHandler,), {
+        'batcher': MicroBatcher(annotator, max_batch_size, max_wait)})
+    if socket_path:
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        server = UnixHTTPServer(socket_path, handler)
+        print(f"Serving on unix socket {socket_path}")
+    else:
+        server = ThreadingHTTPServer((host, port), handler)
+        print(f"Serving on http://{host}:{port}")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Keep an ImageAnnotator warm and serve predictions over HTTP.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--socket", help="serve on this unix socket instead of TCP")
+    parser.add_argument("--max-batch-size", type=int, default=8)
+    parser.add_argument("--max-wait-ms", type=float, default=10,
+                        help="how long the first request of a batch waits for others")
+    parser.add_argument("--model-backend", default="torch",
+                        choices=["torch", "onnx", "quantized"])
+    parser.add_argument("--single-ocr-pass", action="store_true")
+    args = parser.parse_args()
+
+    annotator = ImageAnnotator(
+        model_backend=args.model_backend, single_ocr_pass=args.single_ocr_pass)
+    serve(annotator, args.host, args.port, args.socket,
+          args.max_batch_size, args.max_wait_ms / 1000)
@@ -0,0 +1,66 @@
+import json
+import os
+
+
+def journal_path(annotations_path):
+    """The edits of an annotations file not saved yet are kept next to it, in <file>.journal"""
+    return f'{annotations_path}.journal'
+
+
+class EditJournal:
+    """
+    Append-only log of the edits of an annotations file, one JSON line per edit written as soon as it is made,
+    so a crash loses nothing and an edit costs one small write whatever the size of the page.
+    The edits set or delete a region by its id, replaying them on the file is harmless even if the file
+    already has them. Saving the file compacts the journal down to the edits made since.
+    """
+
+    def __init__(self, annotations_path):
+        self.path = journal_path(annotations_path)
+        self.seq = 0
+        # (seq, line) of the edits missing from the annotations file
+        self.pending = []
+        self.file = None
+
+    def read(self):
+        """Return the edits left by a previous session, which stay pending until the next save."""
+        edits = []
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                for line in f:
+                    try:
+                        edit = json.loads(line)
+                    except ValueError:
+                        # last line cut by a crash
+                        continue
+                    edits.append(edit)
+        self.pending = [(edit['seq'], json.dumps(edit)) for edit in edits]
+        self.seq = max((edit['seq'] for edit in edits), default=0)
+        return edits
+
+    def append(self, op, **fields):
+        self.seq += 1
+        line = json.dumps({'seq': self.seq, 'op': op, **fields})
+        if self.file is None:
+            self.file = open(self.path, 'a')
+        self.file.write(line + '\n')
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.pending.append((self.seq, line))
+
+    def compact(self, saved_seq):
+        """Drop the edits up to saved_seq, which are in the annotations file now."""
+        self.close()
+        self.pending = [(seq, line) for seq, line in self.pending if seq > saved_seq]
+        if not self.pending:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            return
+        with open(f'{self.path}.tmp', 'w') as f:
+            f.writelines(line + '\n' for _, line in self.pending)
+        os.replace(f'{self.path}.tmp', self.path)
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
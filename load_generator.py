@@ -0,0 +1,83 @@
+import argparse
+import http.client
+import json
+import os
+import socket
+import threading
+import time
+import numpy as np
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, socket_path):
+        super().__init__('localhost')
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(self.socket_path)
+
+
+def connect(host, port, socket_path):
+    if socket_path:
+        return UnixHTTPConnection(socket_path)
+    return http.client.HTTPConnection(host, port)
+
+
+def request(connection, method, path, body=None):
+    headers = {'Content-Type': 'application/json'} if body is not None else {}
+    connection.request(method, path, body=body, headers=headers)
+    response = connection.getresponse()
+    return response.status, json.loads(response.read())
+
+
+def run_load(image_paths, num_requests, concurrency, host='127.0.0.1', port=8000, socket_path=None):
+    """Send num_requests predictions from concurrency threads, return the latencies in seconds and the errors."""
+    latencies, errors = [], []
+    lock = threading.Lock()
+    counter = iter(range(num_requests))
+
+    def worker():
+        connection = connect(host, port, socket_path)
+        for i in counter:
+            body = json.dumps(
+                {'path': os.path.abspath(image_paths[i % len(image_paths)])})
+            start = time.perf_counter()
+            status, data = request(connection, 'POST', '/predict', body)
+            with lock:
+                latencies.append(time.perf_counter() - start)
+                if status != 200:
+                    errors.append(data.get('error'))
+        connection.close()
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return np.array(latencies), errors
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark a running inference_server.py with concurrent requests.")
+    parser.add_argument("images", help="folder containing the images to send")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--socket", help="unix socket of the server")
+    args = parser.parse_args()
+
+    image_paths = sorted(os.path.join(args.images, image) for image in os.listdir(
+        args.images) if image.endswith(".png"))
+    start = time.perf_counter()
+    latencies, errors = run_load(image_paths, args.requests, args.concurrency,
+                                 args.host, args.port, args.socket)
+    elapsed = time.perf_counter() - start
+
+    print(f"{len(latencies)} requests in {elapsed:.2f}s: {len(latencies) / elapsed:.2f} requests/sec, "
+          f"{len(errors)} errors")
+    print("latency " + ", ".join(f"p{q} {np.percentile(latencies, q) * 1000:.1f} ms" for q in (50, 90, 99)))
+    connection = connect(args.host, args.port, args.socket)
+    print(f"server metrics: {request(connection, 'GET', '/metrics')[1]}")
@@ -0,0 +1,87 @@
+import os
+from importlib.util import find_spec
+import numpy as np
+
+# torch, transformers and onnxruntime take seconds to import, they are only imported when a model is loaded
+
+# inputs of the LayoutLMv3 token classifier, in the order of its forward signature
+MODEL_INPUTS = ['input_ids', 'bbox', 'attention_mask', 'pixel_values']
+
+QUANTIZED_WEIGHTS = 'quantized_state_dict.pt'
+
+
+def require(package, purpose):
+    """Raise a clear ImportError when an optional package is missing, without importing it."""
+    if find_spec(package) is None:
+        raise ImportError(f"{purpose} requires the {package} package, "
+                          f"install it with pip install -r requirements.txt")
+
+
+def quantize(model):
+    """Dynamic int8 quantization of the Linear layers, activations stay in float.
+
+    The relative position biases are left alone, LayoutLMv3 reads their weight matrix directly.
+    """
+    import torch
+    qconfig_spec = {name: torch.quantization.default_dynamic_qconfig for name, module in model.named_modules()
+                    if isinstance(module, torch.nn.Linear) and 'rel_pos' not in name}
+    return torch.quantization.quantize_dynamic(model.eval(), qconfig_spec, dtype=torch.qint8)
+
+
+def save_quantized_model(model, quantized_path):
+    """Save the config and the int8 weights, quantized models can't go through save_pretrained."""
+    import torch
+    os.makedirs(quantized_path, exist_ok=True)
+    model.config.save_pretrained(quantized_path)
+    torch.save(model.state_dict(), os.path.join(
+        quantized_path, QUANTIZED_WEIGHTS))
+
+
+def load_quantized_model(quantized_path):
+    import torch
+    from transformers import AutoConfig, AutoModelForTokenClassification
+    config = AutoConfig.from_pretrained(quantized_path)
+    model = quantize(AutoModelForTokenClassification.from_config(config))
+    model.load_state_dict(torch.load(
+        os.path.join(quantized_path, QUANTIZED_WEIGHTS)))
+    return model
+
+
+class TorchModel:
+    """Forward pass with the PyTorch model, returning the logits as a NumPy array."""
+
+    name = 'torch'
+
+    def __init__(self, model, num_threads=None):
+        import torch
+        self.model = model.eval()
+        if num_threads:
+            torch.set_num_threads(num_threads)
+
+    def __call__(self, encoding):
+        import torch
+        with torch.no_grad():
+            output = self.model(**{name: torch.as_tensor(encoding[name]) for name in MODEL_INPUTS})
+        return output.logits.numpy()
+
+
+class OnnxModel:
+    """Forward pass with ONNX Runtime on CPU, from a model written by export_onnx.py."""
+
+    name = 'onnx'
+
+    def __init__(self, onnx_path, num_threads=None):
+        require('onnxruntime', "The onnx model backend")
+        import onnxruntime
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.session = onnxruntime.InferenceSession(
+            onnx_path, options, providers=['CPUExecutionProvider'])
+        self.input_names = [model_input.name for model_input in self.session.get_inputs()]
+
+    def __call__(self, encoding):
+        inputs = {name: np.asarray(encoding[name]) for name in self.input_names}
+        inputs['pixel_values'] = inputs['pixel_values'].astype(np.float32)
+        return self.session.run(['logits'], inputs)[0]
@@ -1,44 +1,178 @@
+import argparse
+import json
 import os
-import shutil
-
-from convert_pdf_to_image import convert_to_images
-from ocr import extract_texts_from_images
-
-# Create the temporary directory
-os.mkdir('img')
-
-# Move images to the temporary directory
-for image in os.listdir('images'):
-    shutil.move(os.path.join('images', image), 'img')
-
-# Convert PDFs to images
-input_folder = 'to_convert'
-output_folder = 'images'
-convert_to_images(input_folder, output_folder)
-
-# Extract texts from images
-input_path = 'images'
-output_dir = 'todo'
-extract_texts_from_images(input_path, output_dir)
-
-# Move images back from the temporary directory, handling existing files
-for image in os.listdir('img'):
-    src = os.path.join('img', image)
-    dst = os.path.join('images', image)
-
-    # If destination file exists, rename the source file
-    if os.path.exists(dst):
-        base, ext = os.path.splitext(image)
-        i = 1
-        new_name = f"{base}_{i}{ext}"
-        new_dst = os.path.join('images', new_name)
-        while os.path.exists(new_dst):
-            i += 1
-            new_name = f"{base}_{i}{ext}"
-            new_dst = os.path.join('images', new_name)
-        shutil.move(src, new_dst)
-    else:
-        shutil.move(src, dst)
-
-# Remove the temporary directory
-shutil.rmtree('img')
+import time
+from pathlib import Path
+
+from pdf2image import pdfinfo_from_path
+from cache import file_digest
+from convert_pdf_to_image import page_image_name
+from dedup import DedupIndex, reuse_canonical_work
+from ocr import IMAGE_EXTENSIONS, extract_texts_from_paths
+from pipeline import run_staged_pipeline
+
+# Sources already ingested, keyed by content hash so a renamed or re-dropped file is not ingested twice
+MANIFEST_PATH = 'ingested.json'
+
+
+def load_manifest(manifest_path=MANIFEST_PATH):
+    if not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path) as f:
+        return json.load(f)
+
+
+def save_manifest(manifest, manifest_path=MANIFEST_PATH):
+    with open(f'{manifest_path}.tmp', mode='w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(f'{manifest_path}.tmp', manifest_path)
+
+
+def task_names(image_names):
+    """The tasks are named after the images without their extension, a.png and a.jpg would share a.json."""
+    return {os.path.splitext(name)[0] for name in image_names}
+
+
+def unique_stem(stem, names, taken):
+    """
+    Return the first of stem, stem_1, stem_2... whose images and tasks names are all free.
+    :param names: function giving the image names of a stem
+    :param taken: task names of the image folder and of the other sources of this batch, updated
+    """
+    candidate, i = stem, 0
+    while task_names(names(candidate)) & taken:
+        i += 1
+        candidate = f'{stem}_{i}'
+    taken.update(task_names(names(candidate)))
+    return candidate
+
+
+def file_stat(path):
+    stat = path.stat()
+    return [path.name, stat.st_size, stat.st_mtime_ns]
+
+
+def find_new_sources(to_convert_folder, manifest):
+    """
+    Return the (path, hash) of the PDFs and images of to_convert_folder missing from the manifest, or only
+    partially ingested by a failed run.
+    Only the files whose name, size or mtime is not in the manifest are hashed, the copies of ingested
+    files found on the way are added to the manifest so that they are not hashed again.
+    """
+    seen = {tuple(file) for entry in manifest.values() for file in entry.get('files', [])}
+    sources = []
+    for path in sorted(Path(to_convert_folder).iterdir()):
+        if path.suffix.lower() == '.pdf' or path.suffix.lower() in IMAGE_EXTENSIONS:
+            if tuple(file_stat(path)) in seen:
+                continue
+            digest = file_digest(path)
+            if digest in manifest and not manifest[digest].get('partial'):
+                manifest[digest].setdefault('files', []).append(file_stat(path))
+            else:
+                sources.append((path, digest))
+    return sources
+
+
+def ingest(to_convert_folder='to_convert', image_folder='images', output_dir='todo', done_dir='done',
+           manifest_path=MANIFEST_PATH, rasterize_workers=2, ocr_workers=4, annotator=None, dedup=True):
+    """
+    Convert and OCR the new files of to_convert_folder only. The images and tasks already in
+    image_folder and output_dir are never moved or overwritten, new ones get a unique name.
+    Failed sources are recorded as partial in the manifest: the next run retries them under the same
+    name, overwriting the pages written by the failed run instead of adding another copy of them.
+    :param annotator: ImageAnnotator pre-labeling the new tasks, see pipeline.run_staged_pipeline
+    :param dedup: skip the OCR of the exact duplicates of known pages and give them the task of the known
+        page, and give the near-duplicates with the same words the labels of the annotated known page.
+        The duplicates are only pre-filled in output_dir, see dedup.reuse_canonical_work
+    :return: list of (path, error) for the sources that could not be processed
+    """
+    manifest = load_manifest(manifest_path)
+    sources = find_new_sources(to_convert_folder, manifest)
+    if not sources:
+        save_manifest(manifest, manifest_path)
+        print("No new files to ingest")
+        return []
+    os.makedirs(image_folder, exist_ok=True)
+
+    taken, retried = task_names(os.listdir(image_folder)), set()
+    jobs, errors, image_names, stems = [], [], {}, {}
+    for path, digest in sources:
+        if path.suffix.lower() == '.pdf':
+            try:
+                page_count = pdfinfo_from_path(path)['Pages']
+            except Exception as e:
+                errors.append((str(path), f'{type(e).__name__}: {e}'))
+                continue
+            names = lambda stem: [page_image_name(stem, i, page_count) for i in range(page_count)]
+        else:
+            names = lambda stem: [f'{stem}{path.suffix}']
+        if manifest.get(digest, {}).get('partial') and digest not in retried:
+            stem = manifest[digest]['stem']
+            retried.add(digest)
+            taken.update(task_names(names(stem)))
+        else:
+            stem = unique_stem(path.stem, names, taken)
+        stems[path] = stem
+        image_names[path] = names(stem)
+        if path.suffix.lower() == '.pdf':
+            jobs.append((path, 'pdf', stem))
+        else:
+            # the images are copied, the sources stay in to_convert_folder and are skipped by hash
+            jobs.append((path, 'image', f'{image_folder}/{stem}{path.suffix}'))
+
+    dedup_index = None
+    if dedup:
+        dedup_index = DedupIndex()
+        # only the images that were never hashed are read
+        dedup_index.add_folder(image_folder)
+    failed = set()
+    for stage, path, error in run_staged_pipeline(jobs, image_folder, output_dir, rasterize_workers=rasterize_workers,
+                                                  ocr_workers=ocr_workers, annotator=annotator, dedup=dedup_index):
+        errors.append((str(path), f'{stage}: {error}'))
+        # a page that failed pre-labeling still has its task
+        if stage != 'prelabel':
+            failed.add(path)
+    if dedup_index is not None:
+        report, missing = reuse_canonical_work(dedup_index.found, image_folder, output_dir, done_dir)
+        # the exact duplicates of a page without a task are OCR'd like any other page
+        sources_of = dict((image_path, path) for path, image_path in missing)
+        for image_path, error in extract_texts_from_paths(list(sources_of), output_dir):
+            errors.append((str(sources_of[image_path]), f'ocr: {error}'))
+            failed.add(sources_of[image_path])
+        dedup_index.save()
+        print(f"{report['duplicates']} exact duplicate pages reused the OCR of a known page, "
+              f"{report['confirmed']} of {report['candidates']} near-duplicates had the same words and "
+              f"got the labels of an annotated page")
+    for path, digest in sources:
+        if path in image_names and path not in failed:
+            manifest[digest] = {'source': path.name, 'ingested': time.time(), 'images': image_names[path],
+                                'files': [file_stat(path)]}
+        elif path in image_names and manifest.get(digest, {'partial': True}).get('partial'):
+            # some of its pages may be written already, the retry reuses their names
+            manifest[digest] = {'source': path.name, 'partial': True, 'stem': stems[path],
+                                'images': image_names[path]}
+
+    save_manifest(manifest, manifest_path)
+    print(f"Ingested {len(image_names) - len(failed)} new files, {len(errors)} errors")
+    return errors
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Convert and OCR the new PDFs and images of to_convert into images and todo.")
+    parser.add_argument("--rasterize-workers", type=int, default=2)
+    parser.add_argument("--ocr-workers", type=int, default=os.cpu_count())
+    parser.add_argument("--prelabel", action="store_true",
+                        help="pre-label the new tasks with the model")
+    parser.add_argument("--no-dedup", action="store_true",
+                        help="OCR the exact duplicates of known pages too")
+    args = parser.parse_args()
+
+    annotator = None
+    if args.prelabel:
+        from Inference import ImageAnnotator
+        # windowed so that every word of long pages gets a label
+        annotator = ImageAnnotator(windowed=True)
+    for path, error in ingest(rasterize_workers=args.rasterize_workers, ocr_workers=args.ocr_workers,
+                              annotator=annotator, dedup=not args.no_dedup):
+        print(f"Error processing {path}: {error}")
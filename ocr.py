@@ -1,9 +1,18 @@
 import json
-import pytesseract
+import numpy as np
 from PIL import Image
-from uuid import uuid4
 import os
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack
+from itertools import repeat
 from tqdm import tqdm
+from ocr_backends import get_backend, to_pil
+
+try:
+    # same output as json.dump, several times faster on the large tasks of dense pages
+    import ujson
+except ImportError:
+    ujson = None
 
 # tesseract output levels for the level of detail for the bounding boxes
 LEVELS = {
@@ -14,6 +23,17 @@ LEVELS = {
     'word_num': 5
 }
 
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif')
+
+# OCR results shared by every stage of the pipeline, keyed by image content
+OCR_CACHE_DIR = '.ocr_cache'
+
+
+def region_ids(n):
+    """n random region ids formatted like str(uuid4())[:10], from a single call to os.urandom."""
+    digits = os.urandom(5 * n).hex()
+    return [f'{digits[i:i + 8]}-{digits[i + 8]}' for i in range(0, 10 * n, 10)]
+
 
 def convert_to_ls(image, tesseract_output):
     """
@@ -24,31 +44,24 @@ def convert_to_ls(image, tesseract_output):
     """
     image_width, image_height = image.size
     per_level_idx = LEVELS['word_num']
+    texts = tesseract_output['text']
+    # word level rows with a text, the boxes of all of them are computed at once
+    rows = [i for i in np.flatnonzero(np.asarray(tesseract_output['level']) == per_level_idx).tolist()
+            if texts[i]]
+    boxes = zip(*(
+        (100 * np.asarray(tesseract_output[column])[rows] / size).tolist()
+        for column, size in [('left', image_width), ('top', image_height),
+                             ('width', image_width), ('height', image_height)]))
+    all_scores = [tesseract_output['conf'][i] for i in rows]
     results = []
-    all_scores = []
-    for i, level_idx in enumerate(tesseract_output['level']):
-        if level_idx == per_level_idx:
-            bbox = {
-                'x': 100 * tesseract_output['left'][i] / image_width,
-                'y': 100 * tesseract_output['top'][i] / image_height,
-                'width': 100 * tesseract_output['width'][i] / image_width,
-                'height': 100 * tesseract_output['height'][i] / image_height,
-                'rotation': 0
-            }
-            text = tesseract_output['text'][i]
-            label = 'O'
-            if not text:
-                continue
-            region_id = str(uuid4())[:10]
-            score = tesseract_output['conf'][i]
-            bbox_result = {
-                'id': region_id, 'from_name': 'bbox', 'to_name': 'image', 'type': 'rectangle',
-                'value': bbox}
-            transcription_result = {
-                'id': region_id, 'from_name': 'transcription', 'to_name': 'image', 'type': 'textarea',
-                'value': dict(text=text, label=label, **bbox), 'score': score}
-            results.extend([bbox_result, transcription_result])
-            all_scores.append(score)
+    for region_id, i, (x, y, width, height), score in zip(region_ids(len(rows)), rows, boxes, all_scores):
+        bbox = {'x': x, 'y': y, 'width': width, 'height': height, 'rotation': 0}
+        results.append({
+            'id': region_id, 'from_name': 'bbox', 'to_name': 'image', 'type': 'rectangle',
+            'value': bbox})
+        results.append({
+            'id': region_id, 'from_name': 'transcription', 'to_name': 'image', 'type': 'textarea',
+            'value': dict(text=texts[i], label='O', **bbox), 'score': score})
 
     return {
         'data': {
@@ -61,28 +74,150 @@ def convert_to_ls(image, tesseract_output):
     }
 
 
-def extract_text_from_image(image_path, output_dir):
-    image = Image.open(image_path)
-    tesseract_output = pytesseract.image_to_data(
-        image.convert('L'), lang='fra', output_type=pytesseract.Output.DICT)
-    task = convert_to_ls(image, tesseract_output)
+_backends = {}
+
+
+def get_ocr_backend(name='pytesseract'):
+    """Return the OCR backend of this process, created on first use and then reused across images."""
+    if name not in _backends:
+        _backends[name] = get_backend(
+            name, lang='fra', cache_dir=OCR_CACHE_DIR)
+    return _backends[name]
+
+
+def extract_words(image, backend=None):
+    """
+    :param image: PIL image object or RGB array
+    :param backend: OCR backend, the pytesseract one by default
+    :return: the words found by tesseract and their [left, top, right, bottom] boxes in pixels
+    """
+    backend = backend or get_ocr_backend()
+    tesseract_output = backend.image_to_data(to_pil(image).convert('L'))
+    words, boxes = [], []
+    for i, level_idx in enumerate(tesseract_output['level']):
+        text = tesseract_output['text'][i].strip()
+        if level_idx == LEVELS['word_num'] and text:
+            left, top = tesseract_output['left'][i], tesseract_output['top'][i]
+            words.append(text)
+            boxes.append([left, top, left + tesseract_output['width'][i],
+                          top + tesseract_output['height'][i]])
+    return words, boxes
+
+
+def get_output_file(image_path, output_dir):
+    return f'{output_dir}/{os.path.splitext(os.path.basename(image_path))[0]}.json'
+
+
+def is_up_to_date(image_path, output_dir):
+    """Check if the JSON task of an image already exists and is newer than the image."""
+    output_file = get_output_file(image_path, output_dir)
+    return os.path.exists(output_file) and os.path.getmtime(output_file) >= os.path.getmtime(image_path)
+
+
+def save_task(task, image_path, output_dir):
     if not os.path.exists(output_dir):
-        os.makedirs(output_dir)
-    output_file = f'{
-        output_dir}/{image_path.split("/")[-1].replace(".png", ".json")}'
-    with open(output_file, mode='w') as f:
-        json.dump(task, f, indent=2)
+        os.makedirs(output_dir, exist_ok=True)
+    output_file = get_output_file(image_path, output_dir)
+    # Write to a temporary file first so an interrupted run never leaves a truncated task behind
+    with open(f'{output_file}.tmp', mode='w') as f:
+        if ujson is not None:
+            ujson.dump(task, f, indent=2, escape_forward_slashes=False)
+        else:
+            json.dump(task, f, indent=2)
+    os.replace(f'{output_file}.tmp', output_file)
+
+
+def load_image(image_path):
+    """Decode an image and close its file, so that a chunk of images doesn't hold one file handle each."""
+    with Image.open(image_path) as image:
+        image.load()
+    return image
+
+
+def extract_text_from_image(image_path, output_dir, backend=None):
+    backend = backend or get_ocr_backend()
+    image = load_image(image_path)
+    tesseract_output = backend.image_to_data(image.convert('L'))
+    save_task(convert_to_ls(image, tesseract_output), image_path, output_dir)
+
+
+def _extract_text_from_image_safely(image_path, output_dir, backend_name):
+    """Run extract_text_from_image and return the error message instead of raising."""
+    try:
+        extract_text_from_image(
+            image_path, output_dir, get_ocr_backend(backend_name))
+    except Exception as e:
+        return f'{type(e).__name__}: {e}'
+    return None
+
+
+def _extract_texts_safely(image_paths, output_dir, backend_name):
+    """OCR a chunk of images with a single backend call, returning one error message (or None) per image."""
+    backend = get_ocr_backend(backend_name)
+    try:
+        images = [load_image(image_path) for image_path in image_paths]
+        tesseract_outputs = backend.images_to_data(
+            [image.convert('L') for image in images])
+        for image_path, image, tesseract_output in zip(image_paths, images, tesseract_outputs):
+            save_task(convert_to_ls(image, tesseract_output),
+                      image_path, output_dir)
+        return [None] * len(image_paths)
+    except Exception:
+        # Fall back to one call per image to find out which ones failed
+        return [_extract_text_from_image_safely(image_path, output_dir, backend_name)
+                for image_path in image_paths]
+
+
+def extract_texts_from_images(image_dir, output_dir, workers=1, backend='pytesseract', chunk_size=8):
+    """
+    :param image_dir: folder containing the images to OCR
+    :param output_dir: folder where the Label Studio tasks are written
+    :param workers: number of processes running tesseract in parallel
+    :param backend: name of the OCR backend, see ocr_backends.BACKENDS
+    :param chunk_size: number of images given to the backend at once
+    :return: list of (image_path, error) for the images that could not be processed
+    """
+    image_paths = [f'{image_dir}/{image}' for image in sorted(os.listdir(image_dir))
+                   if image.lower().endswith(IMAGE_EXTENSIONS)]
+    pending = [image_path for image_path in image_paths
+               if not is_up_to_date(image_path, output_dir)]
+    return extract_texts_from_paths(pending, output_dir, workers, backend, chunk_size)
+
 
+def extract_texts_from_paths(pending, output_dir, workers=1, backend='pytesseract', chunk_size=8):
+    """OCR the given images, same parameters and return value as extract_texts_from_images."""
+    chunks = [pending[i:i + chunk_size]
+              for i in range(0, len(pending), chunk_size)]
+    os.makedirs(output_dir, exist_ok=True)
 
-def extract_texts_from_images(image_dir, output_dir):
-    for image_path in tqdm(os.listdir(image_dir), desc='Extracting texts'):
-        extract_text_from_image(f'{image_dir}/{image_path}', output_dir)
+    errors = []
+    with ExitStack() as stack:
+        if workers > 1:
+            executor = stack.enter_context(
+                ProcessPoolExecutor(max_workers=workers))
+            outcomes = executor.map(_extract_texts_safely, chunks,
+                                    repeat(output_dir), repeat(backend))
+        else:
+            outcomes = map(_extract_texts_safely, chunks,
+                           repeat(output_dir), repeat(backend))
+        # map yields in submission order, so progress and errors follow the sorted file list
+        with tqdm(total=len(pending), desc='Extracting texts') as progress_bar:
+            for chunk, chunk_errors in zip(chunks, outcomes):
+                errors.extend((image_path, error) for image_path, error in zip(
+                    chunk, chunk_errors) if error is not None)
+                progress_bar.update(len(chunk))
+    return errors
 
 
 if __name__ == "__main__":
     input_path = input("Enter the path: ")
     output_dir = input("Enter the output directory: ")
     if os.path.isdir(input_path):
-        extract_texts_from_images(input_path, output_dir)
+        workers = input(
+            f"Enter the number of workers (default {os.cpu_count()}): ")
+        errors = extract_texts_from_images(
+            input_path, output_dir, workers=int(workers or os.cpu_count()))
+        for image_path, error in errors:
+            print(f"Error processing {image_path}: {error}")
     else:
         extract_text_from_image(input_path, output_dir)
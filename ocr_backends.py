@@ -0,0 +1,222 @@
+import hashlib
+import os
+import shlex
+import subprocess
+import tempfile
+import numpy as np
+from PIL import Image
+from cache import DiskCache
+
+# header of the tsv written by tesseract, tesserocr only returns the rows
+TSV_HEADER = '\t'.join(['level', 'page_num', 'block_num', 'par_num', 'line_num', 'word_num',
+                        'left', 'top', 'width', 'height', 'conf', 'text'])
+
+
+def to_pil(image):
+    if isinstance(image, np.ndarray):
+        return Image.fromarray(image)
+    return image
+
+
+def image_digest(image):
+    """Hash of the decoded pixels, so the same page gets the same key whatever file it comes from."""
+    image = to_pil(image)
+    digest = hashlib.sha256(f'{image.mode}{image.size}'.encode())
+    digest.update(image.tobytes())
+    return digest.hexdigest()
+
+
+def file_to_dict(tsv):
+    # pytesseract pulls in pandas when it is installed, so it is only imported when OCR is needed
+    from pytesseract.pytesseract import file_to_dict
+    return file_to_dict(tsv, '\t', -1)
+
+
+def tesserocr_options(config):
+    """
+    Translate the tesseract command line options of config into PyTessBaseAPI arguments, so the
+    tesserocr backend reads the pages like the other backends and the OCR cache keys stay right.
+    Only --psm, --oem and -c var=value have an equivalent, any other option raises a ValueError.
+    """
+    options = {'variables': {}}
+    args = shlex.split(config)
+    while args:
+        arg = args.pop(0)
+        if arg in ('--psm', '--oem', '-c') and not args:
+            raise ValueError(f"Missing value after {arg} in the tesseract config {config!r}")
+        if arg in ('--psm', '--oem'):
+            options[arg[2:]] = int(args.pop(0))
+        elif arg == '-c':
+            name, _, value = args.pop(0).partition('=')
+            options['variables'][name] = value
+        else:
+            raise ValueError(
+                f"The tesserocr backend does not support the tesseract option {arg}, "
+                "only --psm, --oem and -c var=value")
+    return options
+
+
+class PytesseractBackend:
+    """Default backend: every call starts a new tesseract process through pytesseract."""
+
+    name = 'pytesseract'
+
+    def __init__(self, lang='fra', config=''):
+        self.lang = lang
+        self.config = config
+
+    def image_to_data(self, image):
+        """Return the tesseract output of an image as a dict, like pytesseract.Output.DICT."""
+        import pytesseract
+        return pytesseract.image_to_data(
+            image, lang=self.lang, config=self.config, output_type=pytesseract.Output.DICT)
+
+    def image_to_string(self, image):
+        import pytesseract
+        return pytesseract.image_to_string(image, lang=self.lang, config=self.config)
+
+    def images_to_data(self, images):
+        return [self.image_to_data(image) for image in images]
+
+    def images_to_string(self, images):
+        return [self.image_to_string(image) for image in images]
+
+    def close(self):
+        pass
+
+
+class TesserocrBackend(PytesseractBackend):
+    """Persistent in-process engine: the traineddata is loaded once and the API handle reused.
+
+    The handle is not thread-safe, use one backend per thread or process.
+    """
+
+    name = 'tesserocr'
+
+    def __init__(self, lang='fra', config=''):
+        try:
+            import tesserocr
+        except ImportError:
+            raise ImportError(
+                "The tesserocr backend requires the tesserocr package")
+        super().__init__(lang, config)
+        self.api = tesserocr.PyTessBaseAPI(lang=lang, **tesserocr_options(config))
+
+    def image_to_data(self, image):
+        self.api.SetImage(to_pil(image))
+        self.api.Recognize()
+        return file_to_dict(f'{TSV_HEADER}\n{self.api.GetTSVText(0)}')
+
+    def image_to_string(self, image):
+        self.api.SetImage(to_pil(image))
+        return self.api.GetUTF8Text()
+
+    def close(self):
+        self.api.End()
+
+
+class BatchCliBackend(PytesseractBackend):
+    """Runs one tesseract process over a list file of images, so the traineddata is loaded once per batch."""
+
+    name = 'batch'
+
+    def run_tesseract(self, images, extension):
+        import pytesseract
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            list_file = os.path.join(tmp_dir, 'images.txt')
+            with open(list_file, 'w') as f:
+                for i, image in enumerate(images):
+                    image_path = os.path.join(tmp_dir, f'{i}.png')
+                    to_pil(image).save(image_path, 'PNG')
+                    f.write(f'{image_path}\n')
+            output_base = os.path.join(tmp_dir, 'output')
+            command = [pytesseract.pytesseract.tesseract_cmd,
+                       list_file, output_base, '-l', self.lang]
+            if extension == 'tsv':
+                command += ['-c', 'tessedit_create_tsv=1']
+            command += self.config.split()
+            subprocess.run(command, check=True, capture_output=True)
+            with open(f'{output_base}.{extension}', encoding='utf-8') as f:
+                return f.read()
+
+    def images_to_data(self, images):
+        if not images:
+            return []
+        data = file_to_dict(self.run_tesseract(images, 'tsv'))
+        # the rows of every image are concatenated, page_num tells them apart
+        pages = [{key: [] for key in data} for _ in images]
+        for i, page_num in enumerate(data.get('page_num', [])):
+            for key, values in data.items():
+                if i < len(values):
+                    pages[page_num - 1][key].append(values[i])
+        return pages
+
+    def images_to_string(self, images):
+        if not images:
+            return []
+        # tesseract ends every page of the text output with a form feed
+        texts = self.run_tesseract(images, 'txt').split('\f')[:len(images)]
+        return texts + [''] * (len(images) - len(texts))
+
+    def image_to_data(self, image):
+        return self.images_to_data([image])[0]
+
+    def image_to_string(self, image):
+        return self.images_to_string([image])[0]
+
+
+class CachedBackend:
+    """Wraps a backend with an on-disk cache keyed by image content, tesseract language and config."""
+
+    def __init__(self, backend, cache):
+        self.backend = backend
+        self.cache = cache
+        self.name = backend.name
+        self.lang = backend.lang
+        self.config = backend.config
+
+    def key(self, image, kind):
+        return hashlib.sha256(
+            f'{image_digest(image)}|{self.lang}|{self.config}|{kind}'.encode()).hexdigest()
+
+    def cached(self, images, kind, compute):
+        keys = [self.key(image, kind) for image in images]
+        results = [self.cache.get(key) for key in keys]
+        missing = [i for i, result in enumerate(results) if result is None]
+        if missing:
+            # the images missing from the cache still go to the backend in a single call
+            computed = compute([images[i] for i in missing])
+            for i, result in zip(missing, computed):
+                self.cache.put(keys[i], result)
+                results[i] = result
+        return results
+
+    def images_to_data(self, images):
+        return self.cached(images, 'data', self.backend.images_to_data)
+
+    def images_to_string(self, images):
+        return self.cached(images, 'string', self.backend.images_to_string)
+
+    def image_to_data(self, image):
+        return self.images_to_data([image])[0]
+
+    def image_to_string(self, image):
+        return self.images_to_string([image])[0]
+
+    def close(self):
+        self.backend.close()
+
+
+BACKENDS = {backend.name: backend for backend in [
+    PytesseractBackend, TesserocrBackend, BatchCliBackend]}
+
+
+def get_backend(name='pytesseract', lang='fra', config='', cache_dir=None, cache_max_bytes=1 << 30):
+    """Create an OCR backend, wrapped with the on-disk OCR cache when cache_dir is given."""
+    if name not in BACKENDS:
+        raise ValueError(
+            f"Unknown OCR backend {name}, choose one of {list(BACKENDS)}")
+    backend = BACKENDS[name](lang=lang, config=config)
+    if cache_dir:
+        backend = CachedBackend(backend, DiskCache(cache_dir, cache_max_bytes))
+    return backend
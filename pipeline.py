@@ -0,0 +1,214 @@
+import os
+import queue
+import shutil
+import threading
+import time
+from functools import partial
+from pathlib import Path
+from convert_pdf_to_image import page_image_name, rasterize_pages
+from ocr import IMAGE_EXTENSIONS, OCR_CACHE_DIR, convert_to_ls, load_image, save_task
+from ocr_backends import get_backend
+
+STOP = object()
+
+
+class Stage:
+    """Workers applying a function to the items of a bounded input queue.
+
+    The function returns an iterable of items for the next stage. A full downstream queue blocks
+    the workers, that time is reported as blocked rather than busy.
+    """
+
+    def __init__(self, name, function, workers=1, queue_size=8):
+        self.name = name
+        self.function = function
+        self.workers = workers
+        self.queue = queue.Queue(queue_size)
+        self.lock = threading.Lock()
+        self.threads = []
+        self.items = 0
+        self.busy = 0.0
+        self.blocked = 0.0
+        self.errors = []
+
+    def start(self, next_stage=None):
+        self.threads = [threading.Thread(target=self.work, args=(next_stage,), daemon=True)
+                        for _ in range(self.workers)]
+        for thread in self.threads:
+            thread.start()
+
+    def work(self, next_stage):
+        while (item := self.queue.get()) is not STOP:
+            busy, blocked = 0.0, 0.0
+            start = time.perf_counter()
+            try:
+                # outputs are produced lazily so a slow next stage holds back this one
+                for output in self.function(item):
+                    busy += time.perf_counter() - start
+                    start = time.perf_counter()
+                    if next_stage is not None:
+                        next_stage.queue.put(output)
+                    blocked += time.perf_counter() - start
+                    start = time.perf_counter()
+            except Exception as e:
+                with self.lock:
+                    self.errors.append((self.name, item[0], f'{type(e).__name__}: {e}'))
+            busy += time.perf_counter() - start
+            with self.lock:
+                self.items += 1
+                self.busy += busy
+                self.blocked += blocked
+
+    def stop(self):
+        for _ in self.threads:
+            self.queue.put(STOP)
+        for thread in self.threads:
+            thread.join()
+
+    def stats(self, elapsed):
+        return {'workers': self.workers, 'items': self.items, 'errors': len(self.errors),
+                'utilization': self.busy / (elapsed * self.workers) if elapsed else 0,
+                'blocked': self.blocked}
+
+
+class StagedPipeline:
+    """Stages connected by bounded queues, every item is a tuple starting with its source."""
+
+    def __init__(self, stages):
+        self.stages = stages
+
+    def run(self, items):
+        """Push the items through the stages and return the (stage, source, error) of the failures."""
+        start = time.perf_counter()
+        for stage, next_stage in zip(self.stages, self.stages[1:] + [None]):
+            stage.start(next_stage)
+        for item in items:
+            self.stages[0].queue.put(item)
+        # a stage is stopped once every item of the previous one went through
+        for stage in self.stages:
+            stage.stop()
+        self.elapsed = time.perf_counter() - start
+        return [error for stage in self.stages for error in stage.errors]
+
+    def print_stats(self):
+        for stage in self.stages:
+            stats = stage.stats(self.elapsed)
+            print(f"  {stage.name}: {stats['workers']} workers, {stats['items']} items, "
+                  f"{stats['utilization']:.0%} busy, {stats['blocked']:.1f}s blocked on the next stage, "
+                  f"{stats['errors']} errors")
+
+
+_thread_backends = threading.local()
+
+
+def get_thread_ocr_backend(name):
+    """OCR backend of the calling thread, tesserocr handles can't be shared between threads."""
+    if not hasattr(_thread_backends, name):
+        setattr(_thread_backends, name, get_backend(name, lang='fra', cache_dir=OCR_CACHE_DIR))
+    return getattr(_thread_backends, name)
+
+
+def load_pages(job, image_folder, dpi=200, chunk_size=8):
+    """Yield (source, page image) for a (path, 'pdf', stem) or a (path, 'image', image_path) job."""
+    path, kind, target = job
+    if kind == 'image':
+        shutil.copy2(path, target)
+        # decoded here, the file is not held open while the page waits in the queues
+        yield path, load_image(target)
+        return
+    for page_index, page_count, image in rasterize_pages(path, dpi, chunk_size):
+        # convert_to_ls reads the path of the task from the image
+        image.filename = f'{image_folder}/{page_image_name(target, page_index, page_count)}'
+        yield path, image
+
+
+def dedup_page(item, dedup):
+    """Hold back the exact duplicates of pages already seen, their PNG is still written."""
+    source, image = item
+    if dedup.check(os.path.basename(image.filename), image, source) is None:
+        yield item
+    elif not os.path.exists(image.filename):
+        image.save(image.filename, 'PNG')
+
+
+def ocr_page(item, backend_name):
+    source, image = item
+    yield source, image, get_thread_ocr_backend(backend_name).image_to_data(image.convert('L'))
+
+
+def save_page(item, output_dir):
+    """Write the PNG of a rasterized page, then its task so that is_up_to_date sees it as newer."""
+    source, image, tesseract_output = item
+    # the image jobs were already copied by load_pages
+    if not os.path.exists(image.filename):
+        image.save(image.filename, 'PNG')
+    task = convert_to_ls(image, tesseract_output)
+    save_task(task, image.filename, output_dir)
+    yield source, image, task
+
+
+def prelabel_page(item, annotator, output_dir):
+    """Replace the "O" labels of the task by the labels predicted by the model for every word."""
+    source, image, task = item
+    width, height = image.size
+    transcriptions = [result['value'] for result in task['predictions'][0]['result']
+                      if result['from_name'] == 'transcription']
+    words = [value['text'] for value in transcriptions]
+    boxes = [[value['x'] * width / 100, value['y'] * height / 100,
+              (value['x'] + value['width']) * width / 100, (value['y'] + value['height']) * height / 100]
+             for value in transcriptions]
+    # the words without prediction keep the "O" label
+    for value, label in zip(transcriptions, annotator.get_word_labels(image, (words, boxes))):
+        value['label'] = str(label)
+    save_task(task, image.filename, output_dir)
+    return ()
+
+
+def run_staged_pipeline(jobs, image_folder, output_dir, dpi=200, chunk_size=8, backend='pytesseract',
+                        rasterize_workers=2, ocr_workers=4, save_workers=1, annotator=None, dedup=None,
+                        queue_size=8):
+    """
+    Stream the pages of the jobs through rasterize -> ocr -> save -> prelabel, every stage with its
+    own threads. The stages are connected by queues of queue_size items, so at most a few pages
+    per stage are held in memory.
+    :param jobs: (path, 'pdf', stem) and (path, 'image', image_path) tuples, see load_pages
+    :param annotator: ImageAnnotator pre-labeling the tasks, in windowed mode so that the words of long
+        pages are not truncated away; without it the tasks keep the "O" labels
+    :param dedup: dedup.DedupIndex, the exact duplicates it finds skip the following stages; they and the
+        near-duplicate candidates are listed in dedup.found
+    :return: list of (stage, source, error)
+    """
+    os.makedirs(image_folder, exist_ok=True)
+    stages = [
+        Stage('rasterize', partial(load_pages, image_folder=image_folder, dpi=dpi, chunk_size=chunk_size),
+              rasterize_workers, queue_size),
+        Stage('ocr', partial(ocr_page, backend_name=backend), ocr_workers, queue_size),
+        Stage('save', partial(save_page, output_dir=output_dir), save_workers, queue_size),
+    ]
+    if dedup is not None:
+        stages.insert(1, Stage('dedup', partial(dedup_page, dedup=dedup), 1, queue_size))
+    if annotator is not None:
+        stages.append(Stage('prelabel', partial(prelabel_page, annotator=annotator, output_dir=output_dir),
+                            1, queue_size))
+    pipeline = StagedPipeline(stages)
+    errors = pipeline.run(jobs)
+    pages = stages[1].items
+    print(f"{pages} pages in {pipeline.elapsed:.1f}s: {pages / pipeline.elapsed:.2f} pages/sec")
+    pipeline.print_stats()
+    return errors
+
+
+if __name__ == "__main__":
+    pdf_folder = input("Enter the folder name containing PDFs and images to convert: ")
+    image_folder = input("Enter the folder name to save the converted images: ")
+    output_dir = input("Enter the output directory: ")
+    ocr_workers = input(f"Enter the number of OCR workers (default {os.cpu_count()}): ")
+    jobs = []
+    for path in sorted(Path(pdf_folder).iterdir()):
+        if path.suffix.lower() == '.pdf':
+            jobs.append((path, 'pdf', path.stem))
+        elif path.suffix.lower() in IMAGE_EXTENSIONS:
+            jobs.append((path, 'image', f'{image_folder}/{path.name}'))
+    for stage, path, error in run_staged_pipeline(jobs, image_folder, output_dir,
+                                                  ocr_workers=int(ocr_workers or os.cpu_count())):
+        print(f"Error processing {path} ({stage}): {error}")
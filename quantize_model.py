@@ -0,0 +1,20 @@
+import json
+from transformers import AutoModelForTokenClassification
+from model_backends import quantize, save_quantized_model
+
+
+def quantize_model(model_path, labels_path, quantized_path):
+    """Quantize the fine-tuned model to dynamic int8 and save it next to the original one."""
+    with open(labels_path) as f:
+        label2id = json.load(f)
+    model = AutoModelForTokenClassification.from_pretrained(
+        model_path, num_labels=len(label2id))
+    save_quantized_model(quantize(model), quantized_path)
+
+
+if __name__ == "__main__":
+    model_path = input("Enter the path of the model to quantize (default model): ")
+    quantized_path = input(
+        "Enter the path of the quantized model (default model_quantized): ")
+    quantize_model(model_path or "model", "labels.json",
+                   quantized_path or "model_quantized")
@@ -0,0 +1,62 @@
+from collections import defaultdict
+
+
+class GridIndex:
+    """Boxes bucketed in a uniform grid of cell_size pixels, for point and rectangle queries
+    that only look at the boxes of the cells they touch."""
+
+    def __init__(self, cell_size=64):
+        self.cell_size = cell_size
+        self.cells = defaultdict(set)
+        self.boxes = {}
+
+    def __len__(self):
+        return len(self.boxes)
+
+    def __contains__(self, key):
+        return key in self.boxes
+
+    def cells_of(self, x1, y1, x2, y2):
+        for i in range(int(x1 // self.cell_size), int(x2 // self.cell_size) + 1):
+            for j in range(int(y1 // self.cell_size), int(y2 // self.cell_size) + 1):
+                yield i, j
+
+    def insert(self, key, box):
+        """Add or move the box of key, the corners can be given in any order."""
+        self.remove(key)
+        x1, y1, x2, y2 = box
+        box = (min(x1, x2), min(y1, y2), max(x1, x2), max(y1, y2))
+        self.boxes[key] = box
+        for cell in self.cells_of(*box):
+            self.cells[cell].add(key)
+
+    def remove(self, key):
+        box = self.boxes.pop(key, None)
+        if box is None:
+            return
+        for cell in self.cells_of(*box):
+            self.cells[cell].discard(key)
+            if not self.cells[cell]:
+                del self.cells[cell]
+
+    def clear(self):
+        self.cells.clear()
+        self.boxes.clear()
+
+    def query_point(self, x, y):
+        """Return the keys of the boxes containing the point, sorted."""
+        cell = (int(x // self.cell_size), int(y // self.cell_size))
+        return sorted(key for key in self.cells.get(cell, ())
+                      if self.boxes[key][0] <= x <= self.boxes[key][2]
+                      and self.boxes[key][1] <= y <= self.boxes[key][3])
+
+    def query_rect(self, x1, y1, x2, y2):
+        """Return the keys of the boxes intersecting the rectangle, sorted."""
+        x1, x2 = min(x1, x2), max(x1, x2)
+        y1, y2 = min(y1, y2), max(y1, y2)
+        keys = set()
+        for cell in self.cells_of(x1, y1, x2, y2):
+            keys.update(self.cells.get(cell, ()))
+        return sorted(key for key in keys
+                      if self.boxes[key][0] <= x2 and x1 <= self.boxes[key][2]
+                      and self.boxes[key][1] <= y2 and y1 <= self.boxes[key][3])
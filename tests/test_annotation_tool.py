@@ -0,0 +1,116 @@
+import json
+import os
+import threading
+from types import SimpleNamespace
+
+import pytest
+from PIL import Image
+
+tk = pytest.importorskip("tkinter")
+import annotation_tool  # noqa: E402
+from format_output import generate_training_data  # noqa: E402
+
+
+@pytest.fixture
+def root():
+    try:
+        root = tk.Tk()
+    except tk.TclError:
+        pytest.skip("no display")
+    root.withdraw()
+    yield root
+    root.destroy()
+
+
+def make_task(image_path, words):
+    """Task of a page with one "O" box per word, on a line."""
+    results = []
+    for i, word in enumerate(words):
+        bbox = {'x': 10.0 + 20 * i, 'y': 10.0, 'width': 15.0, 'height': 5.0, 'rotation': 0}
+        results.append({'id': f'region-{i}', 'from_name': 'bbox', 'to_name': 'image',
+                        'type': 'rectangle', 'value': bbox})
+        results.append({'id': f'region-{i}', 'from_name': 'transcription', 'to_name': 'image',
+                        'type': 'textarea', 'value': {**bbox, 'text': word, 'label': 'O'}})
+    return {'data': {'ocr': image_path}, 'predictions': [{'result': results, 'score': 100}]}
+
+
+def label_box(app, x, y, label, text):
+    app.on_click(SimpleNamespace(x=x, y=y))
+    # selecting a box fills the entries with its label and text
+    app.label_entry.delete(0, tk.END)
+    app.label_entry.insert(0, label)
+    app.text_entry.delete(0, tk.END)
+    app.text_entry.insert(0, text)
+    app.add_label()
+
+
+@pytest.fixture
+def errors(monkeypatch):
+    """The messages of the error dialogs, the info dialogs are dismissed."""
+    errors = []
+    monkeypatch.setattr(annotation_tool.messagebox, 'showinfo', lambda *args, **kwargs: None)
+    monkeypatch.setattr(annotation_tool.messagebox, 'showerror', lambda title, message: errors.append(message))
+    return errors
+
+
+@pytest.fixture
+def app(root, tmp_path, monkeypatch, errors):
+    """The tool showing todo/page.json, a 400x400 page with boxes at (40, 40) and (120, 40)."""
+    monkeypatch.chdir(tmp_path)
+    os.makedirs('images')
+    os.makedirs('todo')
+    Image.new('RGB', (400, 400), 'white').save('images/page.png')
+    with open('todo/page.json', 'w') as f:
+        json.dump(make_task('images/page.png', ['Invoice', '42']), f)
+    with open('labels.json', 'w') as f:
+        json.dump({'O': 0, 'TITLE': 1, 'TOTAL': 2}, f)
+
+    app = annotation_tool.AnnotationTool(root)
+    app.annotations_path = 'todo/page.json'
+    app.refresh_annotations()
+    return app
+
+
+def test_training_data_after_save_and_move_to_done(app):
+    label_box(app, 45, 45, 'title', 'Invoice')
+    app.save_annotations()
+    app.check_save(wait=True)
+    # left in the journal only, it has to reach done/ anyway
+    label_box(app, 125, 45, 'total', '42')
+    assert os.path.exists('todo/page.json.journal')
+    app.move_to_done()
+
+    assert os.listdir('done') == ['page.json']
+    assert not os.path.exists('todo/page.json.journal')
+    generate_training_data('done')
+    with open('Training_layoutLMV3.json') as f:
+        training_data = json.load(f)
+    assert training_data[0]['tokens'] == ['Invoice', '42']
+    assert training_data[0]['ner_tags'] == [1, 2]
+
+
+def test_saves_in_flight_are_all_reported(app, errors, monkeypatch):
+    write_annotations_file = annotation_tool.write_annotations_file
+    release = threading.Event()
+    writes = []
+
+    def write(path, data):
+        writes.append(path)
+        release.wait(5)
+        if len(writes) == 1:
+            raise OSError("disk full")
+        write_annotations_file(path, data)
+
+    monkeypatch.setattr(annotation_tool, 'write_annotations_file', write)
+    label_box(app, 45, 45, 'title', 'Invoice')
+    app.save_annotations()
+    label_box(app, 125, 45, 'total', '42')
+    # the first save is still being written
+    app.save_annotations()
+    release.set()
+    app.check_save(wait=True)
+
+    assert errors == ["disk full"]
+    # the second save wrote both edits
+    assert not os.path.exists('todo/page.json.journal')
+    assert app.status_label.cget('text').startswith("Saved")
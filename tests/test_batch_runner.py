@@ -0,0 +1,79 @@
+import json
+import os
+
+import pytest
+from PIL import Image
+
+Inference = pytest.importorskip("Inference")
+import batch_runner  # noqa: E402
+from batch_runner import BatchRunner  # noqa: E402
+
+
+class FakeAnnotator:
+    """Stands in for the model: the result of a page is its file name."""
+
+    annotated = []
+
+    def __init__(self, **kwargs):
+        pass
+
+    def fingerprint(self):
+        return 'model-1'
+
+    def run_batch(self, image_paths, batch_size):
+        FakeAnnotator.annotated += [os.path.basename(path) for path in image_paths]
+        return [{'image': os.path.basename(path)} for path in image_paths], [None] * len(image_paths)
+
+
+@pytest.fixture
+def folders(tmp_path, monkeypatch):
+    monkeypatch.setattr(Inference, 'ImageAnnotator', FakeAnnotator)
+    FakeAnnotator.annotated = []
+    image_dir, results_dir = tmp_path / 'images', tmp_path / 'results'
+    image_dir.mkdir()
+    for name, color in [('a.png', 'white'), ('b.png', 'black')]:
+        Image.new('RGB', (20, 20), color).save(image_dir / name)
+    return str(image_dir), str(results_dir)
+
+
+def count_digests(monkeypatch):
+    digested = []
+    file_digest = batch_runner.file_digest
+    monkeypatch.setattr(batch_runner, 'file_digest', lambda path: digested.append(path) or file_digest(path))
+    return digested
+
+
+def test_results_without_manifest_are_not_annotated_again(folders):
+    image_dir, results_dir = folders
+    os.makedirs(results_dir)
+    with open(os.path.join(results_dir, 'a.json'), 'w') as f:
+        json.dump({'image': 'a.png'}, f)
+
+    runner = BatchRunner(image_dir, results_dir)
+    assert [image for image, _ in runner.pending()] == ['b.png']
+    assert runner.run() == []
+    assert FakeAnnotator.annotated == ['b.png']
+    assert os.path.exists(runner.manifest_path)
+
+
+def test_unchanged_images_are_not_hashed_again(folders, monkeypatch):
+    image_dir, results_dir = folders
+    BatchRunner(image_dir, results_dir).run()
+    assert FakeAnnotator.annotated == ['a.png', 'b.png']
+
+    digested = count_digests(monkeypatch)
+    runner = BatchRunner(image_dir, results_dir)
+    assert runner.pending() == []
+    assert digested == []
+
+    # rewritten with other pixels, a.png gets a new size and mtime
+    Image.new('RGB', (30, 30), 'white').save(os.path.join(image_dir, 'a.png'))
+    assert [image for image, _ in runner.pending()] == ['a.png']
+    assert digested == [os.path.join(image_dir, 'a.png')]
+
+
+def test_new_model_annotates_everything_again(folders, monkeypatch):
+    image_dir, results_dir = folders
+    BatchRunner(image_dir, results_dir).run()
+    monkeypatch.setattr(FakeAnnotator, 'fingerprint', lambda self: 'model-2')
+    assert [image for image, _ in BatchRunner(image_dir, results_dir).pending()] == ['a.png', 'b.png']
@@ -0,0 +1,67 @@
+import os
+
+from cache import DiskCache, MemoryCache, TieredCache, file_digest
+
+
+def test_file_digest(tmp_path):
+    path = tmp_path / 'a.bin'
+    path.write_bytes(b'abc' * 1000)
+    assert file_digest(path, chunk_size=7) == file_digest(path)
+    assert file_digest(path) != file_digest(__file__)
+
+
+def test_disk_cache_get_put(tmp_path):
+    cache = DiskCache(str(tmp_path))
+    assert cache.get('ab12') is None
+    cache.put('ab12', {'words': ['Invoice']})
+    assert cache.get('ab12') == {'words': ['Invoice']}
+    assert cache.stats()['hits'] == 1 and cache.stats()['misses'] == 1
+    # another process sharing the folder sees the value and its size
+    assert DiskCache(str(tmp_path)).get('ab12') == {'words': ['Invoice']}
+    assert DiskCache(str(tmp_path)).size == cache.size
+
+
+def test_disk_cache_overwrite_keeps_the_size(tmp_path):
+    cache = DiskCache(str(tmp_path), max_bytes=1000)
+    for i in range(100):
+        cache.put('ab12', {'value': i % 10})
+    assert cache.size == os.path.getsize(cache.path('ab12'))
+    assert cache.evictions == 0
+
+
+def test_disk_cache_evicts_the_least_recently_used(tmp_path):
+    # 22 bytes per value
+    cache = DiskCache(str(tmp_path), max_bytes=80)
+    for i, key in enumerate(['aa01', 'bb02', 'cc03']):
+        cache.put(key, 'x' * 20)
+        # the mtime is the recency, set far apart for the file systems with a coarse mtime
+        os.utime(cache.path(key), (1000 * (i + 1), 1000 * (i + 1)))
+    cache.get('aa01')
+    cache.put('dd04', 'x' * 20)
+    assert cache.evictions == 1
+    assert sorted(entry.name for entry in cache.entries()) == ['aa01.json', 'cc03.json', 'dd04.json']
+    assert cache.size == 66
+
+
+def test_memory_cache():
+    cache = MemoryCache(max_bytes=20)
+    cache.put('a', [1, 2])
+    value = cache.get('a')
+    value.append(3)
+    # the cached value can't be modified in place
+    assert cache.get('a') == [1, 2]
+    cache.put('a', [4])
+    assert cache.size == len('[4]')
+    cache.put('b', 'x' * 10)
+    cache.get('a')
+    cache.put('c', 'x' * 10)
+    assert cache.get('b') is None and cache.get('a') == [4]
+    assert cache.stats()['evictions'] == 1
+
+
+def test_tiered_cache_promotes_disk_hits(tmp_path):
+    DiskCache(str(tmp_path)).put('ab12', 42)
+    cache = TieredCache(MemoryCache(), DiskCache(str(tmp_path)))
+    assert cache.get('ab12') == 42
+    assert cache.memory.get('ab12') == 42
+    assert cache.get('cd34') is None
@@ -0,0 +1,109 @@
+import json
+import os
+
+import numpy as np
+import pytest
+from PIL import Image, ImageDraw
+
+from dedup import DedupIndex, HashIndex, dhash, load_duplicates, reuse_canonical_work
+from ocr import convert_to_ls
+
+
+def make_page(seed, noise=0):
+    """A page of black bars, with some grey noise for a rescan of the same page."""
+    rng = np.random.default_rng(seed)
+    image = Image.new('L', (300, 400), 255)
+    draw = ImageDraw.Draw(image)
+    for _ in range(30):
+        x, y = rng.integers(0, 270), rng.integers(0, 390)
+        draw.rectangle([x, y, x + rng.integers(5, 30), y + 4], fill=0)
+    pixels = np.asarray(image).astype(int)
+    if noise:
+        pixels = np.clip(pixels + np.random.default_rng(seed + 1).normal(0, noise, pixels.shape), 0, 255)
+    return Image.fromarray(pixels.astype(np.uint8)).convert('RGB')
+
+
+def test_hash_index_finds_the_closest_hash():
+    index = HashIndex(max_distance=8)
+    index.add('a', 0)
+    index.add('b', 0b111)
+    assert index.find(0b1) == ('a', 1)
+    assert index.find(0b110) == ('b', 1)
+    assert index.find((1 << 20) - 1) is None
+
+
+def test_rescan_is_close_and_other_page_is_far():
+    page = dhash(make_page(0))
+    assert (page ^ dhash(make_page(0, noise=6))).bit_count() <= 8
+    assert (page ^ dhash(make_page(1))).bit_count() > 8
+
+
+def test_check_tells_exact_duplicates_from_candidates(tmp_path):
+    index = DedupIndex(str(tmp_path / 'dedup.json'))
+    assert index.check('a.png', make_page(0), 'a.pdf') is None
+    assert index.check('b.png', make_page(0), 'b.pdf') == 'a.png'
+    assert index.check('c.png', make_page(0, noise=6), 'c.pdf') is None
+    assert index.check('d.png', make_page(1), 'd.pdf') is None
+    assert index.found == [('b.pdf', 'b.png', 'a.png', True), ('c.pdf', 'c.png', 'a.png', False)]
+
+    index.save()
+    loaded = DedupIndex(str(tmp_path / 'dedup.json'))
+    assert loaded.duplicates == {'b.png': 'a.png'}
+    assert loaded.candidates == {'c.png': 'a.png'}
+    assert loaded.check('e.png', make_page(1)) == 'd.png'
+    assert load_duplicates(str(tmp_path / 'dedup.json')) == {'b.png': 'a.png'}
+
+
+def test_duplicates_of_old_files_are_dropped(tmp_path):
+    path = tmp_path / 'dedup.json'
+    with open(path, 'w') as f:
+        json.dump({'hashes': {'a.png': f'{dhash(make_page(0)):x}'}, 'duplicates': {'b.png': 'a.png'}}, f)
+    assert DedupIndex(str(path)).duplicates == {}
+    assert load_duplicates(str(path)) == {}
+
+
+@pytest.fixture
+def folders(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    for folder in ['images', 'todo', 'done']:
+        os.makedirs(folder)
+
+
+def write_task(path, image_path, words, labels=None):
+    image = Image.new('RGB', (100, 100))
+    image.filename = image_path
+    count = len(words)
+    task = convert_to_ls(image, {'level': [5] * count, 'left': list(range(0, 10 * count, 10)), 'top': [0] * count,
+                                 'width': [5] * count, 'height': [5] * count, 'text': words, 'conf': [90] * count})
+    for result in task['predictions'][0]['result']:
+        if result['from_name'] == 'transcription' and labels:
+            result['value']['label'] = labels[result['value']['text']]
+    with open(path, 'w') as f:
+        json.dump(task, f)
+
+
+def labels_of(path):
+    with open(path) as f:
+        return [result['value']['label'] for result in json.load(f)['predictions'][0]['result']
+                if result['from_name'] == 'transcription']
+
+
+def test_reuse_only_pre_fills_todo(folders):
+    write_task('done/a.json', 'images/a.png', ['Invoice', '42'], {'Invoice': 'TITLE', '42': 'TOTAL'})
+    # a rescan with the same words and a page of the same template with another amount
+    write_task('todo/c.json', 'images/c.png', ['Invoice', '42'])
+    write_task('todo/d.json', 'images/d.png', ['Invoice', '250'])
+    done = {name: os.path.getmtime(f'done/{name}') for name in os.listdir('done')}
+    found = [('b.pdf', 'b.png', 'a.png', True), ('c.pdf', 'c.png', 'a.png', False),
+             ('d.pdf', 'd.png', 'a.png', False), ('e.pdf', 'e.png', 'x.png', True)]
+
+    report, missing = reuse_canonical_work(found)
+
+    assert report == {'duplicates': 2, 'candidates': 2, 'confirmed': 1}
+    assert missing == [('e.pdf', 'images/e.png')]
+    with open('todo/b.json') as f:
+        assert json.load(f)['data']['ocr'] == 'images/b.png'
+    assert labels_of('todo/b.json') == ['TITLE', 'TOTAL']
+    assert labels_of('todo/c.json') == ['TITLE', 'TOTAL']
+    assert labels_of('todo/d.json') == ['O', 'O']
+    assert {name: os.path.getmtime(f'done/{name}') for name in os.listdir('done')} == done
@@ -0,0 +1,61 @@
+import json
+import os
+import shutil
+
+import pytest
+from PIL import Image
+
+from document_queue import DocumentQueue, load_document
+
+
+@pytest.fixture
+def todo_dir(tmp_path):
+    image_path = str(tmp_path / 'page.png')
+    Image.new('RGB', (300, 200), 'white').save(image_path)
+    todo_dir = tmp_path / 'todo'
+    todo_dir.mkdir()
+    for name in ['a', 'b', 'c']:
+        with open(todo_dir / f'{name}.json', 'w') as f:
+            json.dump({'data': {'ocr': image_path}, 'predictions': [{'result': []}]}, f)
+    return str(todo_dir)
+
+
+def names(queue, count):
+    return [os.path.basename(queue.next()['path']) for _ in range(count)]
+
+
+def test_load_document(todo_dir):
+    document = load_document(os.path.join(todo_dir, 'a.json'))
+    assert document['image'].size == (300, 200)
+    assert document['image'].getpixel((0, 0)) == (255, 255, 255)
+    assert document['pyramid'] is None
+
+
+def test_files_are_given_in_order_and_skipped_ones_again(todo_dir):
+    queue = DocumentQueue(todo_dir, prefetch=1)
+    assert names(queue, 2) == ['a.json', 'b.json']
+    # a.json was skipped, b.json moved to done
+    shutil.move(os.path.join(todo_dir, 'b.json'), os.path.join(todo_dir, '..', 'b.json'))
+    assert names(queue, 3) == ['c.json', 'a.json', 'c.json']
+
+
+def test_empty_folder(todo_dir):
+    queue = DocumentQueue(todo_dir)
+    for name in os.listdir(todo_dir):
+        os.remove(os.path.join(todo_dir, name))
+    assert queue.next() is None
+
+
+def test_changed_file_is_loaded_again(todo_dir):
+    queue = DocumentQueue(todo_dir, prefetch=1)
+    queue.next()
+    # b.json is prefetched, then edited outside of the queue
+    queue.loading[os.path.join(todo_dir, 'b.json')].result()
+    path = os.path.join(todo_dir, 'b.json')
+    with open(path) as f:
+        data = json.load(f)
+    data['predictions'][0]['result'] = ['edited']
+    with open(path, 'w') as f:
+        json.dump(data, f)
+    os.utime(path, (0, 0))
+    assert queue.next()['data']['predictions'][0]['result'] == ['edited']
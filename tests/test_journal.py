@@ -0,0 +1,45 @@
+import os
+
+from journal import EditJournal, journal_path
+
+
+def test_edits_survive_a_crash(tmp_path):
+    annotations_path = str(tmp_path / 'page.json')
+    journal = EditJournal(annotations_path)
+    journal.append('set', region='a', label='TOTAL')
+    journal.append('delete', region='b')
+    # the process dies without closing the journal, the last line is cut
+    with open(journal_path(annotations_path), 'a') as f:
+        f.write('{"seq": 3, "op"')
+
+    edits = EditJournal(annotations_path).read()
+    assert [edit['op'] for edit in edits] == ['set', 'delete']
+    assert edits[0] == {'seq': 1, 'op': 'set', 'region': 'a', 'label': 'TOTAL'}
+
+
+def test_compact_keeps_the_edits_made_after_the_save(tmp_path):
+    annotations_path = str(tmp_path / 'page.json')
+    journal = EditJournal(annotations_path)
+    journal.append('set', region='a', label='TOTAL')
+    saved_seq = journal.seq
+    journal.append('set', region='b', label='DATE')
+    journal.compact(saved_seq)
+    assert [edit['region'] for edit in EditJournal(annotations_path).read()] == ['b']
+    # new edits go after the ones kept
+    journal.append('delete', region='a')
+    assert [edit['seq'] for edit in EditJournal(annotations_path).read()] == [2, 3]
+
+    journal.compact(journal.seq)
+    assert not os.path.exists(journal_path(annotations_path))
+    assert journal.pending == []
+
+
+def test_read_continues_the_numbering(tmp_path):
+    annotations_path = str(tmp_path / 'page.json')
+    journal = EditJournal(annotations_path)
+    journal.append('set', region='a', label='TOTAL')
+    journal.close()
+    journal = EditJournal(annotations_path)
+    journal.read()
+    journal.append('set', region='a', label='DATE')
+    assert journal.seq == 2 and len(journal.pending) == 2
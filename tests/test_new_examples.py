@@ -0,0 +1,74 @@
+import json
+import os
+
+import pytest
+from PIL import Image, ImageDraw
+
+import convert_pdf_to_image
+import new_examples
+import pipeline
+
+
+def make_page(i):
+    image = Image.new('RGB', (200, 300), 'white')
+    ImageDraw.Draw(image).rectangle([10 + 20 * i, 10, 60 + 20 * i, 30], fill='black')
+    return image
+
+
+@pytest.fixture
+def pdf(tmp_path, monkeypatch):
+    """A three pages PDF in to_convert/, rasterized to fake pages."""
+    monkeypatch.chdir(tmp_path)
+    os.makedirs('to_convert')
+    with open('to_convert/invoice.pdf', 'w') as f:
+        f.write('%PDF')
+    pages = [make_page(i) for i in range(3)]
+    info = lambda path: {'Pages': len(pages)}
+    monkeypatch.setattr(new_examples, 'pdfinfo_from_path', info)
+    monkeypatch.setattr(convert_pdf_to_image, 'pdfinfo_from_path', info)
+    monkeypatch.setattr(convert_pdf_to_image, 'convert_from_path',
+                        lambda path, dpi, first_page, last_page: pages[first_page - 1:last_page])
+    return pages
+
+
+def fake_ocr(fail_page=None):
+    def ocr_page(item, backend_name):
+        source, image = item
+        if image.filename.endswith(f'_{fail_page}.png'):
+            raise RuntimeError("tesseract crashed")
+        yield source, image, {'level': [5], 'left': [10], 'top': [10], 'width': [50], 'height': [20],
+                              'text': [os.path.basename(image.filename)], 'conf': [90]}
+    return ocr_page
+
+
+def test_failed_source_is_retried_under_the_same_name(pdf, monkeypatch):
+    monkeypatch.setattr(pipeline, 'ocr_page', fake_ocr(fail_page=1))
+    errors = new_examples.ingest(ocr_workers=1)
+    assert [path for path, _ in errors] == ['to_convert/invoice.pdf']
+    assert sorted(os.listdir('todo')) == ['invoice_0.json', 'invoice_2.json']
+
+    monkeypatch.setattr(pipeline, 'ocr_page', fake_ocr())
+    assert new_examples.ingest(ocr_workers=1) == []
+    assert sorted(os.listdir('images')) == ['invoice_0.png', 'invoice_1.png', 'invoice_2.png']
+    assert sorted(os.listdir('todo')) == ['invoice_0.json', 'invoice_1.json', 'invoice_2.json']
+    with open('ingested.json') as f:
+        entry, = json.load(f).values()
+    assert 'partial' not in entry and entry['images'] == sorted(os.listdir('images'))
+    # the pages of the first attempt are not duplicates of themselves
+    with open('dedup.json') as f:
+        assert json.load(f)['duplicates'] == {}
+
+    assert new_examples.ingest(ocr_workers=1) == []
+    assert len(os.listdir('images')) == 3
+
+
+def test_images_of_other_formats_get_their_own_task(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(pipeline, 'ocr_page', fake_ocr())
+    os.makedirs('to_convert')
+    os.makedirs('images')
+    make_page(0).save('images/scan.png')
+    make_page(1).save('to_convert/scan.jpg')
+    assert new_examples.ingest(ocr_workers=1) == []
+    assert sorted(os.listdir('images')) == ['scan.png', 'scan_1.jpg']
+    assert os.listdir('todo') == ['scan_1.json']
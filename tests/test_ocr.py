@@ -0,0 +1,78 @@
+import os
+
+import pytest
+from PIL import Image
+
+import ocr
+from ocr import convert_to_ls, get_output_file, is_up_to_date, save_task
+
+
+def test_convert_to_ls_keeps_the_words(tmp_path):
+    image_path = str(tmp_path / 'page.png')
+    Image.new('RGB', (200, 100), 'white').save(image_path)
+    # a line row, an empty word and two words
+    tesseract_output = {'level': [4, 5, 5, 5], 'left': [0, 10, 20, 100], 'top': [0, 10, 10, 50],
+                        'width': [200, 5, 40, 50], 'height': [20, 5, 10, 25],
+                        'text': ['', '', 'Invoice', '42'], 'conf': [-1, 10, 90, 70]}
+    with Image.open(image_path) as image:
+        task = convert_to_ls(image, tesseract_output)
+    assert task['data']['ocr'] == image_path
+    assert task['predictions'][0]['score'] == 80
+    results = task['predictions'][0]['result']
+    assert [result['from_name'] for result in results] == ['bbox', 'transcription'] * 2
+    # the box and the transcription of a word share their region id
+    assert results[0]['id'] == results[1]['id'] != results[2]['id'] == results[3]['id']
+    assert results[1]['value'] == {'x': 10.0, 'y': 10.0, 'width': 20.0, 'height': 10.0, 'rotation': 0,
+                                   'text': 'Invoice', 'label': 'O'}
+    assert results[2]['value'] == {'x': 50.0, 'y': 50.0, 'width': 25.0, 'height': 25.0, 'rotation': 0}
+    assert results[3]['score'] == 70
+
+
+def test_convert_to_ls_without_words(tmp_path):
+    image = Image.new('RGB', (200, 100), 'white')
+    image.filename = 'images/blank.png'
+    task = convert_to_ls(image, {'level': [1], 'left': [0], 'top': [0], 'width': [200], 'height': [100],
+                                 'text': [''], 'conf': [-1]})
+    assert task['predictions'] == [{'result': [], 'score': 0}]
+
+
+def test_tasks_of_every_image_format_are_json_files(tmp_path):
+    for name in ['page.png', 'scan.jpg', 'photo.jpeg', 'fax.gif', 'v1.2.png']:
+        assert get_output_file(f'images/{name}', 'todo') == f'todo/{os.path.splitext(name)[0]}.json'
+
+
+def test_is_up_to_date_finds_the_task_of_a_jpg(tmp_path):
+    image_path = str(tmp_path / 'scan.jpg')
+    Image.new('RGB', (10, 10), 'white').save(image_path)
+    output_dir = str(tmp_path / 'todo')
+    assert not is_up_to_date(image_path, output_dir)
+    save_task({'data': {'ocr': image_path}, 'predictions': [{'result': [], 'score': 0}]}, image_path, output_dir)
+    assert os.listdir(output_dir) == ['scan.json']
+    assert is_up_to_date(image_path, output_dir)
+
+
+class FakeBackend:
+    """One word per page, the size of the image. Counts the open files while OCRing."""
+
+    def __init__(self):
+        self.open_files = []
+
+    def images_to_data(self, images):
+        self.open_files.append(len(os.listdir('/proc/self/fd')))
+        return [{'level': [5], 'left': [0], 'top': [0], 'width': [5], 'height': [5],
+                 'text': [f'{image.width}x{image.height}'], 'conf': [90]} for image in images]
+
+
+@pytest.mark.skipif(not os.path.isdir('/proc/self/fd'), reason="needs /proc to count the open files")
+def test_chunk_of_images_is_ocrd_without_holding_their_files(tmp_path, monkeypatch):
+    backend = FakeBackend()
+    monkeypatch.setattr(ocr, 'get_ocr_backend', lambda name: backend)
+    image_paths = []
+    # unlike the PNGs, the GIFs keep their file open once decoded
+    for i in range(20):
+        image_paths.append(str(tmp_path / f'page_{i}.gif'))
+        Image.new('RGB', (10 + i, 10), 'white').save(image_paths[-1])
+    open_files = len(os.listdir('/proc/self/fd'))
+    assert ocr._extract_texts_safely(image_paths, str(tmp_path / 'todo'), 'fake') == [None] * 20
+    assert backend.open_files == [open_files]
+    assert len(os.listdir(tmp_path / 'todo')) == 20
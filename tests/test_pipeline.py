@@ -0,0 +1,23 @@
+import os
+
+import pytest
+from PIL import Image
+
+from pipeline import load_pages
+
+
+@pytest.mark.skipif(not os.path.isdir('/proc/self/fd'), reason="needs /proc to count the open files")
+def test_image_pages_do_not_hold_their_file(tmp_path):
+    image_folder = tmp_path / 'images'
+    image_folder.mkdir()
+    sources = []
+    for i in range(10):
+        sources.append(tmp_path / f'scan_{i}.gif')
+        Image.new('RGB', (20, 10 + i), 'white').save(sources[-1])
+    open_files = len(os.listdir('/proc/self/fd'))
+    # the pages wait in the queues of the pipeline
+    pages = [page for source in sources
+             for page in load_pages((source, 'image', str(image_folder / source.name)), str(image_folder))]
+    assert len(os.listdir('/proc/self/fd')) == open_files
+    assert [image.size for _, image in pages] == [(20, 10 + i) for i in range(10)]
+    assert pages[0][1].filename == str(image_folder / 'scan_0.gif')
@@ -0,0 +1,154 @@
+import json
+
+import numpy as np
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("pandas")
+from benchmark_inference import legacy_spans, random_page  # noqa: E402
+from Inference import ImageAnnotator, token_confidence  # noqa: E402
+
+LABELS = ["O", "B-DATE", "I-DATE", "B-TOTAL", "I-TOTAL"]
+WIDTH, HEIGHT = 2480, 3508
+
+
+@pytest.fixture
+def annotator(tmp_path):
+    labels_path = tmp_path / 'labels.json'
+    with open(labels_path, 'w') as f:
+        json.dump({label: i for i, label in enumerate(LABELS)}, f)
+    # the model is only loaded by the first prediction, the post-processing doesn't need it
+    return ImageAnnotator(labels_path=str(labels_path), ocr_cache_dir=None, result_cache=False)
+
+
+def spans(annotator, logits, encoding):
+    return list(annotator.get_spans(*annotator.process_logits(logits, encoding, WIDTH, HEIGHT)))
+
+
+def test_spans_match_the_legacy_post_processing(annotator):
+    for seed in range(50):
+        logits, encoding = random_page(len(LABELS), seed=seed)
+        assert spans(annotator, logits, encoding) == legacy_spans(annotator, logits, encoding, WIDTH, HEIGHT)
+
+
+def test_ties_go_to_the_first_label_like_the_legacy_post_processing(annotator):
+    logits, encoding = random_page(len(LABELS), seed=0)
+    # B-DATE and B-TOTAL tie on the even tokens, I-DATE and I-TOTAL on the odd ones
+    logits = torch.zeros_like(logits)
+    logits[0, ::2, [1, 3]] = 1
+    logits[0, 1::2, [2, 4]] = 1
+    expected = legacy_spans(annotator, logits, encoding, WIDTH, HEIGHT)
+    assert spans(annotator, logits, encoding) == expected
+    assert {label for *_, label in expected} == {'DATE'}
+
+
+def test_pages_without_labels_raise_like_the_legacy_post_processing(annotator):
+    logits, encoding = random_page(len(LABELS), seed=0)
+    logits = torch.zeros_like(logits)
+    logits[..., 0] = 1
+    with pytest.raises(ValueError):
+        legacy_spans(annotator, logits, encoding, WIDTH, HEIGHT)
+    with pytest.raises(ValueError):
+        spans(annotator, logits, encoding)
+
+
+class Encoding(dict):
+    """The arrays of a tokenizer output and the word id of every token, like a BatchEncoding."""
+
+    def __init__(self, word_ids, offsets, bbox, sample_mapping=None):
+        super().__init__(offset_mapping=np.array(offsets), bbox=np.array(bbox))
+        if sample_mapping is not None:
+            self['overflow_to_sample_mapping'] = np.array(sample_mapping)
+        self.windows = word_ids
+
+    def word_ids(self, window):
+        return self.windows[window]
+
+
+def legacy_word_predictions(logits, encoding):
+    """Loop over every token of every window, keeping the first most confident prediction of each word."""
+    best = {}
+    sample_mapping = encoding.get('overflow_to_sample_mapping', range(len(encoding.windows)))
+    for window, page in enumerate(sample_mapping):
+        for token, word in enumerate(encoding.word_ids(window)):
+            if word is None or encoding['offset_mapping'][window][token][0] != 0:
+                continue
+            confidence = token_confidence(logits[window][token])
+            if (page, word) not in best or confidence > best[page, word][1]:
+                best[page, word] = (int(np.argmax(logits[window][token])), confidence,
+                                    encoding['bbox'][window][token].tolist())
+    keys = sorted(best)
+    return ([page for page, _ in keys], [word for _, word in keys], [best[key][0] for key in keys],
+            [best[key][1] for key in keys], [best[key][2] for key in keys])
+
+
+def windowed_page(seed=0):
+    """Two pages: three overlapping windows of 8 tokens for the first one, one window for the second."""
+    rng = np.random.default_rng(seed)
+    word_ids = [
+        [None, 0, 1, 1, 2, 3, 4, None],
+        [None, 2, 3, 4, 5, 5, 6, None],
+        [None, 5, 6, 7, 8, 9, None, None],
+        [None, 0, 1, 2, 2, 3, None, None],
+    ]
+    offsets = np.zeros((4, 8, 2), dtype=int)
+    # the second token of the split words, and every token of word 4 of the first page, which has no
+    # first sub-token: it is missing from the predictions
+    offsets[0, 3, 0] = offsets[1, 5, 0] = offsets[3, 4, 0] = 2
+    offsets[0, 6, 0] = offsets[1, 3, 0] = 3
+    logits = rng.normal(size=(4, 8, len(LABELS))).astype(np.float32)
+    # word 3 of the first page gets the same logits in both of its windows, the first window wins
+    logits[1, 2] = logits[0, 5]
+    # and a very confident subword is ignored
+    logits[0, 3, 4] = 50
+    bbox = rng.integers(0, 1000, size=(4, 8, 4))
+    return logits, Encoding(word_ids, offsets, bbox, sample_mapping=[0, 0, 0, 1])
+
+
+def assert_same_predictions(predictions, expected):
+    pages, words, labels, confidence, boxes = predictions
+    expected_pages, expected_words, expected_labels, expected_confidence, expected_boxes = expected
+    assert pages.tolist() == expected_pages
+    assert words.tolist() == expected_words
+    assert labels.tolist() == expected_labels
+    np.testing.assert_allclose(confidence, expected_confidence, rtol=1e-6)
+    assert boxes.tolist() == expected_boxes
+
+
+def test_word_predictions_match_the_token_loop(annotator):
+    for seed in range(20):
+        logits, encoding = windowed_page(seed)
+        predictions = annotator.word_predictions(logits, encoding)
+        assert_same_predictions(predictions, legacy_word_predictions(logits, encoding))
+        pages, words = predictions[:2]
+        assert list(zip(pages.tolist(), words.tolist())) == \
+            [(0, word) for word in [0, 1, 2, 3, 5, 6, 7, 8, 9]] + [(1, word) for word in [0, 1, 2, 3]]
+
+
+def test_word_predictions_keep_the_first_window_on_ties(annotator):
+    logits, encoding = windowed_page()
+    *_, boxes = annotator.word_predictions(logits, encoding)
+    assert boxes[3].tolist() == encoding['bbox'][0, 5].tolist()
+
+
+def test_word_predictions_without_windows(annotator):
+    logits, encoding = windowed_page()
+    del encoding['overflow_to_sample_mapping']
+    predictions = annotator.word_predictions(logits, encoding)
+    assert_same_predictions(predictions, legacy_word_predictions(logits, encoding))
+    assert sorted(set(predictions[0].tolist())) == [0, 1, 2, 3]
+
+
+def test_words_without_prediction_are_labeled_o(annotator, monkeypatch):
+    logits, encoding = windowed_page()
+    encoding['overflow_to_sample_mapping'][:] = 0
+    monkeypatch.setattr(annotator, 'get_batch_predictions', lambda images, pages_words: (encoding, logits))
+    words = [f'w{i}' for i in range(11)]
+    labels = annotator.get_word_labels(np.zeros((10, 10, 3), np.uint8), (words, [[0, 0, 1, 1]] * 11))
+    _, predicted_words, predictions, _, _ = legacy_word_predictions(logits, encoding)
+    expected = ["O"] * 11
+    for word, prediction in zip(predicted_words, predictions):
+        expected[word] = LABELS[prediction]
+    assert labels == expected
+    # word 4 has no first sub-token and word 10 no token at all
+    assert labels[4] == labels[10] == "O"
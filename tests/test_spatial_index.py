@@ -0,0 +1,45 @@
+import random
+
+from spatial_index import GridIndex
+
+
+def test_point_and_rect_queries():
+    index = GridIndex(cell_size=10)
+    index.insert('a', (5, 5, 25, 15))
+    # corners in any order
+    index.insert('b', (40, 30, 20, 12))
+    assert len(index) == 2 and 'a' in index
+    assert index.boxes['b'] == (20, 12, 40, 30)
+    assert index.query_point(22, 14) == ['a', 'b']
+    assert index.query_point(30, 25) == ['b']
+    assert index.query_point(100, 100) == []
+    assert index.query_rect(0, 0, 6, 6) == ['a']
+    assert index.query_rect(45, 35, 35, 25) == ['b']
+
+
+def test_move_and_remove():
+    index = GridIndex(cell_size=10)
+    index.insert('a', (5, 5, 25, 15))
+    index.insert('a', (105, 105, 110, 110))
+    assert index.query_point(10, 10) == []
+    assert index.query_point(107, 107) == ['a']
+    index.remove('a')
+    index.remove('missing')
+    assert len(index) == 0 and not index.cells
+
+
+def test_queries_match_a_scan_of_every_box():
+    rng = random.Random(0)
+    index = GridIndex(cell_size=32)
+    boxes = {}
+    for key in range(300):
+        x, y = rng.uniform(0, 1000), rng.uniform(0, 1000)
+        boxes[key] = (x, y, x + rng.uniform(0, 80), y + rng.uniform(0, 30))
+        index.insert(key, boxes[key])
+    for _ in range(100):
+        x1, y1 = rng.uniform(0, 1000), rng.uniform(0, 1000)
+        x2, y2 = x1 + rng.uniform(0, 200), y1 + rng.uniform(0, 200)
+        assert index.query_rect(x1, y1, x2, y2) == sorted(
+            key for key, box in boxes.items() if box[0] <= x2 and x1 <= box[2] and box[1] <= y2 and y1 <= box[3])
+        assert index.query_point(x1, y1) == sorted(
+            key for key, box in boxes.items() if box[0] <= x1 <= box[2] and box[1] <= y1 <= box[3])